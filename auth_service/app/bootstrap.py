@@ -0,0 +1,23 @@
+from flask import Flask
+
+from utils.users_db import ensure_users_indexes
+from utils.db_manager import close_all_clients
+
+
+def run():
+    """
+    One-off startup tasks, run once before the workers start (see on_starting in gunicorn_conf.py):
+    makes sure the collection indexes exist.
+    """
+    app = Flask(__name__)
+    app.config.from_pyfile('config.py')
+
+    if not app.config['DB_ENSURE_INDEXES']:
+        return
+
+    try:
+        with app.app_context():
+            ensure_users_indexes()
+    finally:
+        # The workers open their own connections
+        close_all_clients()
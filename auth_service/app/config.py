@@ -6,7 +6,58 @@ DB_HOST = 'mongodb'
 DB_PORT = '27017'
 DB_URI = f'mongodb://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/'
 
+# MongoClient pool - one pooled client is shared by the whole process
+DB_MAX_POOL_SIZE = int(os.environ.get('DB_MAX_POOL_SIZE', 50))
+DB_MIN_POOL_SIZE = int(os.environ.get('DB_MIN_POOL_SIZE', 0))
+DB_MAX_IDLE_TIME_MS = int(os.environ.get('DB_MAX_IDLE_TIME_MS', 60 * 1000))
+DB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('DB_WAIT_QUEUE_TIMEOUT_MS', 2 * 1000))
+DB_CONNECT_TIMEOUT_MS = int(os.environ.get('DB_CONNECT_TIMEOUT_MS', 5 * 1000))
+DB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('DB_SERVER_SELECTION_TIMEOUT_MS', 5 * 1000))
+DB_SOCKET_TIMEOUT_MS = int(os.environ.get('DB_SOCKET_TIMEOUT_MS', 10 * 1000))
+DB_ENSURE_INDEXES = os.environ.get('DB_ENSURE_INDEXES', 'true').lower() == 'true'  # create missing indexes on startup
+
 DB_NAME = 'ZEST_DB'
 USERS_COLLECTION = 'users'
 JWT_ALGORITHM = 'HS256'
-JWT_TTL = 3600 * 12  # 12 hours in seconds - half a day
\ No newline at end of file
+JWT_TTL = 3600 * 12  # 12 hours in seconds - half a day
+
+# Password hashing - bcrypt runs in a process pool, away from the request threads
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))  # changing it rehashes passwords on login
+# Every gunicorn worker has its own pool, so the CPUs are shared between the workers' pools
+BCRYPT_POOL_SIZE = int(os.environ.get('BCRYPT_POOL_SIZE', max(
+    (os.cpu_count() or 1) // int(os.environ.get('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1)), 1)))
+BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', BCRYPT_POOL_SIZE * 4))  # more are rejected with 503
+BCRYPT_TIMEOUT = 10  # seconds
+
+# Redis - rate limit buckets, shared by every worker
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_SOCKET_TIMEOUT = 0.5  # seconds - past it the request is let through, rather than kept waiting on the limiter
+REDIS_SOCKET_CONNECT_TIMEOUT = 0.5  # seconds
+REDIS_HEALTH_CHECK_INTERVAL = 30  # seconds - idle connections are pinged before reuse
+
+# Admission control - requests past a rate limit get a 429, requests past the concurrency cap a 503
+RATE_LIMITS_ENABLED = os.environ.get('RATE_LIMITS_ENABLED', 'true').lower() == 'true'
+# Token buckets per route: `rate` requests per second sustained, `burst` at once,
+# per 'user' (JWT user ID) or per client 'ip'
+RATE_LIMITS = {
+    # Every attempt costs a bcrypt hash, and guessing passwords shouldn't be cheap
+    'login': {'rate': 10 / 60, 'burst': 10, 'key': 'ip'},
+    'signup': {'rate': 5 / 60, 'burst': 5, 'key': 'ip'},
+}
+# Concurrency cap per worker, 0 disables it. Defaults to what a worker runs at once (see gunicorn_conf.py):
+# WEB_THREADS with gthread workers, a quarter of WEB_WORKER_CONNECTIONS with gevent ones
+ADMISSION_MAX_CONCURRENT_REQUESTS = int(os.environ.get('ADMISSION_MAX_CONCURRENT_REQUESTS', (
+    int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000)) // 4 if os.environ.get('WEB_WORKER_CLASS') == 'gevent'
+    else int(os.environ.get('WEB_THREADS', 8)))))
+
+# Request profiling - spans of every request are kept, in case it turns out slow.
+# Profiled requests (all, a sample, or those with a matching X-Profile header) also get a stack profile.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))  # fraction of requests profiled
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # X-Profile header value of trusted callers
+PROFILING_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILING_SLOW_REQUEST_MS = int(os.environ.get('PROFILING_SLOW_REQUEST_MS', 1000))  # 0 disables slow request dumps
+PROFILING_DUMP_DIR = './logs/profiles'
+PROFILING_MAX_DUMPS = 200  # oldest dumps are deleted past this
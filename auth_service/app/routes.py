@@ -1,11 +1,14 @@
 from flask import Blueprint, request, jsonify
 
 from users import login_user, signup_user
+from utils.password_hashing import HashingPoolSaturated, get_hashing_stats
+from utils.admission_control import rate_limit
 
 auth_routes = Blueprint('auth_routes', __name__)
 
 
 @auth_routes.route('/login', methods=['POST'])
+@rate_limit('login')
 def login():
     """
     Logs in a user with the provided email and password.
@@ -13,6 +16,8 @@ def login():
     Returns:
         A JSON response containing a success message and a JWT token if the login is successful.
         Otherwise, returns a JSON response containing an error message and an appropriate HTTP status code.
+        If the password hashing pool is too busy, returns a 503 error.
+        If the client sent too many login attempts, returns a 429 error with Retry-After.
     """
     email = request.json.get('email')
     password = request.json.get('password')
@@ -20,7 +25,10 @@ def login():
     if not email or not password:
         return jsonify({'error': 'Missing email or password'}), 400
 
-    jwt_token = login_user(email, password)
+    try:
+        jwt_token = login_user(email, password)
+    except HashingPoolSaturated:
+        return _server_busy()
 
     if not jwt_token:
         return jsonify({'error': 'User does not exist or password and email do not match'}), 401
@@ -29,6 +37,7 @@ def login():
 
 
 @auth_routes.route('/signup', methods=['POST'])
+@rate_limit('signup')
 def signup():
     """
     Signs up a new user with the provided email and password.
@@ -37,6 +46,8 @@ def signup():
         A JSON response containing a success message and a JWT token.
         If the email or password is missing, returns a 400 error.
         If the user already exists, returns a 409 error.
+        If the password hashing pool is too busy, returns a 503 error.
+        If the client sent too many signups, returns a 429 error with Retry-After.
     """
 
     email = request.json.get('email')
@@ -45,9 +56,30 @@ def signup():
     if not email or not password:
         return jsonify({'error': 'Missing email, or password'}), 400
 
-    jwt_token = signup_user(email, password)
+    try:
+        jwt_token = signup_user(email, password)
+    except HashingPoolSaturated:
+        return _server_busy()
 
     if jwt_token is None:
         return jsonify({'error': 'User is already exists'}), 409
 
     return jsonify({'message': 'User created successfully', 'jwt_token': jwt_token}), 201
+
+
+@auth_routes.route('/hashing-stats', methods=['GET'])
+def hashing_stats():
+    """
+    Returns the password hashing settings (including the bcrypt cost factor) and pool usage of this worker.
+
+    Returns:
+        A JSON response containing the hashing stats.
+    """
+    return jsonify(get_hashing_stats()), 200
+
+
+def _server_busy():
+    response = jsonify({'error': 'Server is busy, try again later'})
+    response.headers['Retry-After'] = '1'
+
+    return response, 503
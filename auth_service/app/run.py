@@ -1,14 +1,31 @@
 import os
 from flask import Flask
 
+import bootstrap
 from routes import auth_routes
+from utils.password_hashing import init_password_hashing
+from utils.app_logging import init_request_logging
+from utils.metrics import init_metrics
+from utils.profiling import init_profiling
+from utils.redis_manager import init_redis_pool
+from utils.admission_control import init_admission_control
 
 app = Flask(__name__)
 app.config.from_pyfile('config.py')
 app.register_blueprint(auth_routes, url_prefix='/auth')
+init_request_logging(app)
+init_metrics(app)
+init_profiling(app)
+init_password_hashing(app)
+init_admission_control(app)
+init_redis_pool(app.config)
 
 
 if __name__ == '__main__':
     host = os.environ.get('HOST', '0.0.0.0')
     port = os.environ.get('PORT', 8081)
-    app.run(host=host, port=port, debug=True)
+    # Development server only. In production the app is served by gunicorn, see gunicorn_conf.py
+    debug = os.environ.get('FLASK_DEBUG', 'true').lower() == 'true'
+    # Under gunicorn, the startup tasks run once in the master process instead
+    bootstrap.run()
+    app.run(host=host, port=port, debug=debug)
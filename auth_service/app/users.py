@@ -1,10 +1,10 @@
-import bcrypt
 import time
 import jwt
 import os
 from flask import current_app as app
 
-from utils.users_db import save_user_to_db, get_user_from_db
+from utils.users_db import save_user_to_db, get_user_from_db, update_user_password
+from utils.password_hashing import hash_password, verify_password, needs_rehash, HashingPoolSaturated
 from utils.app_logging import logger
 
 # get the secret key from the environment variables
@@ -20,9 +20,12 @@ def signup_user(email, password):
 
     Returns:
         str: A JWT token with the user ID if the user was successfully signed up, None otherwise.
+
+    Raises:
+        HashingPoolSaturated: If the password hashing pool is too busy.
     """
-    # Hash the password using bcrypt
-    hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    # Hash the password using bcrypt, in the hashing pool
+    hashed_password = hash_password(password)
 
     # Save the user to the database
     user_id = save_user_to_db(email, hashed_password)
@@ -50,6 +53,9 @@ def login_user(email, password):
 
     Returns:
         str: A JWT token if the email and password match, None otherwise.
+
+    Raises:
+        HashingPoolSaturated: If the password hashing pool is too busy.
     """
     # Get the user from the database
     user = get_user_from_db(email)
@@ -59,7 +65,15 @@ def login_user(email, password):
         return None
 
     # Check if the password matches the hashed password in the database
-    if bcrypt.checkpw(password.encode(), user['password']):
+    if verify_password(password, user['password']):
+        # The cost factor changed since the password was hashed, so hash it again with the new one.
+        # If the pool is busy, it will be done on a later login.
+        if needs_rehash(user['password']):
+            try:
+                update_user_password(user['_id'], hash_password(password))
+            except HashingPoolSaturated:
+                logger.warning(f"Skipped rehashing password of user {user['_id']}, hashing pool is busy")
+
         # Create a JWT token with the user ID
         user_id = str(user['_id'])
         experation_time = time.time() + app.config['JWT_TTL']
@@ -0,0 +1,200 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from flask import current_app as app
+
+from utils.app_logging import logger
+from utils.metrics import observe, count_error, DEPENDENCY_PENDING, PASSWORD_HASHING_COST
+
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when the password hashing pool can't take a job: too many are already pending,
+    the job timed out, or the pool broke.
+    """
+
+
+# bcrypt is deliberately CPU heavy, so it runs in a separate process pool instead of
+# on the request threads. Created lazily, once per (forked) worker process.
+_executor = None
+_executor_pid = None
+_pending_slots = None
+_pending_count = 0
+_executor_lock = threading.Lock()
+
+
+def init_password_hashing(app):
+    """
+    Exports the bcrypt cost factor of an app as a metric.
+
+    Args:
+        app (flask.Flask): The application.
+    """
+    PASSWORD_HASHING_COST.set(app.config['BCRYPT_ROUNDS'])
+
+
+def hash_password(password):
+    """
+    Hash a password with bcrypt, using the configured cost factor (BCRYPT_ROUNDS).
+
+    Args:
+        password (str): The password to hash.
+
+    Returns:
+        bytes: The bcrypt hash of the password.
+
+    Raises:
+        HashingPoolSaturated: If the hashing pool already has BCRYPT_MAX_PENDING pending jobs.
+    """
+    # Generating the salt is cheap, only hashpw needs to run in the pool
+    salt = bcrypt.gensalt(app.config['BCRYPT_ROUNDS'])
+
+    return _run_in_pool(bcrypt.hashpw, password.encode(), salt)
+
+
+def verify_password(password, hashed_password):
+    """
+    Check a password against a bcrypt hash.
+
+    Args:
+        password (str): The password to check.
+        hashed_password (bytes): The bcrypt hash to check against.
+
+    Returns:
+        bool: True if the password matches the hash, False otherwise.
+
+    Raises:
+        HashingPoolSaturated: If the hashing pool already has BCRYPT_MAX_PENDING pending jobs.
+    """
+    return _run_in_pool(bcrypt.checkpw, password.encode(), hashed_password)
+
+
+def needs_rehash(hashed_password):
+    """
+    Check whether a bcrypt hash was made with another cost factor than the configured one.
+
+    Args:
+        hashed_password (bytes): A bcrypt hash, e.g. b'$2b$12$...'.
+
+    Returns:
+        bool: True if the hash should be replaced with one made with BCRYPT_ROUNDS.
+    """
+    try:
+        rounds = int(hashed_password.split(b'$')[2])
+    except (IndexError, ValueError):
+        return True
+
+    return rounds != app.config['BCRYPT_ROUNDS']
+
+
+def get_hashing_stats():
+    """
+    Returns the hashing pool settings and how many jobs are pending in this worker.
+    """
+    return {
+        'bcrypt_rounds': app.config['BCRYPT_ROUNDS'],
+        'pool_size': app.config['BCRYPT_POOL_SIZE'],
+        'max_pending': app.config['BCRYPT_MAX_PENDING'],
+        'pending': _pending_count
+    }
+
+
+def _run_in_pool(fn, *args):
+    """
+    Run a function in the hashing pool and wait for its result.
+
+    Fails fast instead of queueing when BCRYPT_MAX_PENDING jobs are already pending,
+    so a login peak is answered with 503s rather than piling up requests. A job's slot is
+    only freed once the job is done, even if its caller stopped waiting for it.
+
+    Raises:
+        HashingPoolSaturated: If the pool is saturated, the job timed out, or the pool broke.
+    """
+    global _pending_count
+
+    executor, pending_slots = _get_executor()
+
+    if not pending_slots.acquire(blocking=False):
+        logger.warning(f"Password hashing pool is saturated. Rejecting request.")
+        count_error('bcrypt', 'saturated')
+
+        raise HashingPoolSaturated()
+
+    with _executor_lock:
+        _pending_count += 1
+
+    DEPENDENCY_PENDING.labels('bcrypt').inc()
+
+    try:
+        future = executor.submit(fn, *args)
+    except (BrokenProcessPool, RuntimeError) as e:
+        _release_slot(pending_slots)
+        _discard_executor(executor)
+        logger.error(f"Password hashing pool is broken. Error: {e}")
+        count_error('bcrypt', 'broken')
+
+        raise HashingPoolSaturated() from e
+
+    future.add_done_callback(lambda _: _release_slot(pending_slots))
+
+    try:
+        with observe('bcrypt', fn.__name__):
+            return future.result(timeout=app.config['BCRYPT_TIMEOUT'])
+    except FutureTimeoutError as e:
+        logger.error(f"Password hashing timed out after {app.config['BCRYPT_TIMEOUT']} seconds")
+
+        raise HashingPoolSaturated() from e
+    except BrokenProcessPool as e:
+        _discard_executor(executor)
+        logger.error(f"Password hashing pool is broken. Error: {e}")
+
+        raise HashingPoolSaturated() from e
+
+
+def _release_slot(pending_slots):
+    global _pending_count
+
+    with _executor_lock:
+        _pending_count -= 1
+
+    DEPENDENCY_PENDING.labels('bcrypt').dec()
+    pending_slots.release()
+
+
+def _discard_executor(executor):
+    """
+    Drops a broken pool, so the next job creates a new one.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+    executor.shutdown(wait=False)
+
+
+def _get_executor():
+    global _executor, _executor_pid, _pending_slots, _pending_count
+
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = None
+            _pending_slots = threading.BoundedSemaphore(app.config['BCRYPT_MAX_PENDING'])
+            _pending_count = 0
+            _executor_pid = os.getpid()
+
+        # Also replaces a broken pool. Jobs of the broken pool still hold their slots until they fail.
+        if _executor is None:
+            # Spawned (not forked) workers don't inherit the request threads' locks
+            _executor = ProcessPoolExecutor(
+                max_workers=app.config['BCRYPT_POOL_SIZE'],
+                mp_context=multiprocessing.get_context('spawn'))
+            logger.info(
+                f"Created password hashing pool. Size: {app.config['BCRYPT_POOL_SIZE']}, "
+                f"bcrypt rounds: {app.config['BCRYPT_ROUNDS']}")
+
+        return _executor, _pending_slots
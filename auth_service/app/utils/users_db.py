@@ -1,9 +1,38 @@
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
 from flask import current_app as app
 
-from utils.db_manager import get_collection, get_database, close_client, create_mongo_client
+from utils.db_manager import get_collection, get_database, get_mongo_client, get_client_options, ensure_indexes
 from utils.app_logging import logger
 
 
+def _get_users_collection():
+    """
+    Get the users collection using the process-wide pooled MongoClient.
+
+    Returns:
+        pymongo.collection.Collection: The users collection.
+    """
+    client = get_mongo_client(app.config['DB_URI'], **get_client_options(app.config))
+    db = get_database(client, app.config['DB_NAME'])
+
+    return get_collection(db, app.config['USERS_COLLECTION'])
+
+
+def ensure_users_indexes():
+    """
+    Create the indexes of the users collection, if missing.
+
+    Returns:
+        bool: True if every index exists, False otherwise.
+    """
+    indexes = [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True)
+    ]
+
+    return ensure_indexes(_get_users_collection(), indexes)
+
+
 def save_user_to_db(email, password):
     """
     Saves a user to the database.
@@ -16,31 +45,23 @@ def save_user_to_db(email, password):
         str: The ID of the inserted user, or None if the user already exists or an error occurred.
     """
 
-    db_uri = app.config['DB_URI']
-    db_name = app.config['DB_NAME']
-    users_collection_name = app.config['USERS_COLLECTION']
-
     try:
-        client = create_mongo_client(db_uri)
-        db = get_database(client, db_name)
-        collection = get_collection(db, users_collection_name)
+        collection = _get_users_collection()
 
-        user = collection.find_one({'email': email})
+        # A single insert - the unique email index rejects existing users, even under concurrent signups
+        user = collection.insert_one(
+            {'email': email, 'password': password})
+        logger.info(f"User {email} saved to database.")
 
-        if user is None:
-            user = collection.insert_one(
-                {'email': email, 'password': password})
-            logger.info(f"User {email} saved to database.")
-
-            return user.inserted_id
+        return user.inserted_id
+    except DuplicateKeyError:
+        logger.warning(f"User {email} already exists.")
 
         return None
     except Exception as e:
         logger.error(f"Error saving user to database: {e}")
 
         return None
-    finally:
-        close_client(client)
 
 
 def get_user_from_db(email):
@@ -54,14 +75,8 @@ def get_user_from_db(email):
         dict: A dictionary containing the user's information, or None if the user is not found.
     """
 
-    db_uri = app.config['DB_URI']
-    db_name = app.config['DB_NAME']
-    users_collection_name = app.config['USERS_COLLECTION']
-
     try:
-        client = create_mongo_client(db_uri)
-        db = get_database(client, db_name)
-        collection = get_collection(db, users_collection_name)
+        collection = _get_users_collection()
 
         if collection is None:
             return None
@@ -73,5 +88,27 @@ def get_user_from_db(email):
         logger.error(f"Error retrieving user from database: {e}")
 
         return None
-    finally:
-        close_client(client)
+
+
+def update_user_password(user_id, password):
+    """
+    Replace the hashed password of a user.
+
+    Args:
+        user_id (bson.ObjectId): The ID of the user.
+        password (bytes): The new hashed password.
+
+    Returns:
+        bool: True if the password was updated, False otherwise.
+    """
+
+    try:
+        collection = _get_users_collection()
+        result = collection.update_one({'_id': user_id}, {'$set': {'password': password}})
+        logger.info(f"Rehashed password of user {user_id}.")
+
+        return result.modified_count == 1
+    except Exception as e:
+        logger.error(f"Error updating user password in database: {e}")
+
+        return False
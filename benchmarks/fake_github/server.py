@@ -0,0 +1,311 @@
+####################################################
+# A stand-in for the parts of GitHub API used by   #
+# the GitHub data service: repository search and   #
+# repositories by ID. Serves a generated, seeded   #
+# set of repositories with GitHub's pagination     #
+# (Link headers), ETags and 304s, rate limit       #
+# headers and 403s, secondary rate limits with     #
+# Retry-After, and a configurable latency.         #
+# Configured with env vars (FAKE_GITHUB_*).        #
+####################################################
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 9090))
+# Base URL of the Link headers, as the clients reach the server
+PUBLIC_URL = os.environ.get('FAKE_GITHUB_PUBLIC_URL', f'http://localhost:{PORT}').rstrip('/')
+
+REPOSITORY_COUNT = int(os.environ.get('FAKE_GITHUB_REPOSITORIES', 5000))
+SEED = int(os.environ.get('FAKE_GITHUB_SEED', 42))
+LATENCY_MS = float(os.environ.get('FAKE_GITHUB_LATENCY_MS', 150))
+LATENCY_JITTER_MS = float(os.environ.get('FAKE_GITHUB_LATENCY_JITTER_MS', 50))
+# Requests per token (or client IP, unauthenticated) per window, like GitHub's search and core limits
+SEARCH_RATE_LIMIT = int(os.environ.get('FAKE_GITHUB_SEARCH_RATE_LIMIT', 30))
+SEARCH_RATE_LIMIT_WINDOW = int(os.environ.get('FAKE_GITHUB_SEARCH_RATE_LIMIT_WINDOW', 60))
+CORE_RATE_LIMIT = int(os.environ.get('FAKE_GITHUB_CORE_RATE_LIMIT', 5000))
+CORE_RATE_LIMIT_WINDOW = int(os.environ.get('FAKE_GITHUB_CORE_RATE_LIMIT_WINDOW', 60 * 60))
+# Fraction of requests refused by the secondary rate limit, with a 403 and Retry-After
+SECONDARY_RATE_LIMIT_RATE = float(os.environ.get('FAKE_GITHUB_SECONDARY_RATE_LIMIT_RATE', 0))
+RETRY_AFTER = int(os.environ.get('FAKE_GITHUB_RETRY_AFTER', 2))
+# Seconds between star count changes, which reorder rankings and change ETags. 0 keeps the data static.
+STAR_DRIFT_INTERVAL = int(os.environ.get('FAKE_GITHUB_STAR_DRIFT_INTERVAL', 0))
+
+MAX_PER_PAGE = 100
+MAX_SEARCH_RESULTS = 1000
+
+LANGUAGES = ('Python', 'JavaScript', 'TypeScript', 'Java', 'Go', 'Rust', 'C++', 'C#', 'Ruby', None)
+TOPICS = ('machine-learning', 'web', 'cli', 'database', 'devops', 'security', 'game', 'api', 'frontend', 'compiler')
+SORT_KEYS = {
+    'stars': 'stargazers_count',
+    'forks': 'forks_count',
+    'updated': 'updated_at'
+}
+QUALIFIER_PATTERN = re.compile(r'(\w+):(\S+)')
+STARTED_AT = time.time()
+
+
+class RateLimiter:
+    """
+    Fixed window request budgets, per client and resource, with GitHub's rate limit headers.
+    """
+
+    def __init__(self):
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def take(self, client, resource):
+        """
+        Returns:
+            tuple: Whether the request is allowed, and the rate limit headers of its response.
+        """
+        limit, window = (SEARCH_RATE_LIMIT, SEARCH_RATE_LIMIT_WINDOW) if resource == 'search' \
+            else (CORE_RATE_LIMIT, CORE_RATE_LIMIT_WINDOW)
+        now = time.time()
+
+        with self._lock:
+            reset_at, used = self._windows.get((client, resource), (0, 0))
+
+            if reset_at <= now:
+                reset_at, used = int(now) + window, 0
+
+            allowed = used < limit
+            used += allowed
+            self._windows[(client, resource)] = (reset_at, used)
+
+        return allowed, {
+            'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(limit - used),
+            'X-RateLimit-Reset': str(reset_at),
+            'X-RateLimit-Resource': resource
+        }
+
+    def refund(self, client, resource):
+        # Like GitHub, 304 responses don't count against the rate limit
+        with self._lock:
+            reset_at, used = self._windows[(client, resource)]
+            self._windows[(client, resource)] = (reset_at, max(used - 1, 0))
+
+
+class Repositories:
+    """
+    The generated repositories. Each has a base star count and a growth rate, so rankings shift
+    at every star drift epoch.
+    """
+
+    def __init__(self, count, seed):
+        rng = random.Random(seed)
+        created_from = datetime(2010, 1, 1, tzinfo=timezone.utc)
+        self.repositories = []
+
+        for index in range(count):
+            repository_id = 1000000 + index
+            owner_id = 5000000 + rng.randrange(count // 3 + 1)
+            login = f'owner{owner_id}'
+            name = f'project-{index}'
+            created_at = created_from + timedelta(days=rng.randrange(4000))
+            updated_at = created_at + timedelta(days=rng.randrange(365))
+            self.repositories.append({
+                'id': repository_id,
+                'name': name,
+                'full_name': f'{login}/{name}',
+                'description': f'Generated repository {index}',
+                'owner': {
+                    'id': owner_id,
+                    'login': login,
+                    'avatar_url': f'https://avatars.example.com/u/{owner_id}',
+                    'html_url': f'https://github.com/{login}'
+                },
+                'html_url': f'https://github.com/{login}/{name}',
+                'clone_url': f'https://github.com/{login}/{name}.git',
+                'language': rng.choice(LANGUAGES),
+                'topics': rng.sample(TOPICS, rng.randrange(4)),
+                # Long tailed, like real star counts
+                'stargazers_count': int(rng.paretovariate(1.2) * 100),
+                'forks_count': rng.randrange(20000),
+                'created_at': _format_time(created_at),
+                'updated_at': _format_time(updated_at),
+                'pushed_at': _format_time(updated_at),
+                'archived': rng.random() < 0.05,
+                'visibility': 'public',
+                'watchers_count': rng.randrange(5000),
+                'open_issues_count': rng.randrange(1000),
+                '_growth': rng.randrange(50)
+            })
+
+        self.by_id = {repository['id']: repository for repository in self.repositories}
+
+    def get(self, repository_id):
+        repository = self.by_id.get(repository_id)
+
+        return _with_stars(repository, _get_epoch()) if repository else None
+
+    def search(self, query, sort, order):
+        """
+        Returns the repositories matching a search query's language: and topic: qualifiers, sorted.
+        Other qualifiers (e.g. stars:>0) match every repository.
+        """
+        qualifiers = dict(QUALIFIER_PATTERN.findall(query))
+        language = qualifiers.get('language', '').lower()
+        topic = qualifiers.get('topic', '').lower()
+        epoch = _get_epoch()
+        results = [_with_stars(repository, epoch) for repository in self.repositories
+                   if (not language or (repository['language'] or '').lower() == language)
+                   and (not topic or topic in repository['topics'])]
+        results.sort(key=lambda repository: (repository[SORT_KEYS.get(sort, 'stargazers_count')], repository['id']),
+                     reverse=order != 'asc')
+
+        return results
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.rate_limit_key = None
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/_stats':
+            return self._send_json(200, stats.snapshot())
+
+        resource = 'search' if url.path.startswith('/search/') else 'core'
+        time.sleep(max(random.gauss(LATENCY_MS, LATENCY_JITTER_MS), 0) / 1000)
+
+        if SECONDARY_RATE_LIMIT_RATE and random.random() < SECONDARY_RATE_LIMIT_RATE:
+            return self._send_json(403, {'message': 'You have exceeded a secondary rate limit.'},
+                                   {'Retry-After': str(RETRY_AFTER)})
+
+        client = self.headers.get('Authorization') or self.client_address[0]
+        allowed, rate_limit_headers = rate_limiter.take(client, resource)
+        self.rate_limit_key = (client, resource) if allowed else None
+
+        if not allowed:
+            return self._send_json(403, {'message': 'API rate limit exceeded.'}, rate_limit_headers)
+
+        if url.path == '/search/repositories':
+            self._search(params, rate_limit_headers)
+        elif url.path.startswith('/repositories/') and url.path[len('/repositories/'):].isdigit():
+            repository = repositories.get(int(url.path[len('/repositories/'):]))
+
+            if repository is None:
+                self._send_json(404, {'message': 'Not Found'}, rate_limit_headers)
+            else:
+                self._send_json(200, repository, rate_limit_headers)
+        else:
+            self._send_json(404, {'message': 'Not Found'}, rate_limit_headers)
+
+    def _search(self, params, headers):
+        try:
+            per_page = min(max(int(params.get('per_page', 30)), 1), MAX_PER_PAGE)
+            page = max(int(params.get('page', 1)), 1)
+        except ValueError:
+            return self._send_json(422, {'message': 'Validation Failed'}, headers)
+
+        results = repositories.search(params.get('q', ''), params.get('sort'), params.get('order', 'desc'))
+        last_page = max((min(len(results), MAX_SEARCH_RESULTS) + per_page - 1) // per_page, 1)
+
+        if (page - 1) * per_page >= MAX_SEARCH_RESULTS:
+            return self._send_json(
+                422, {'message': 'Only the first 1000 search results are available'}, headers)
+
+        links = {'next': page + 1, 'last': last_page} if page < last_page else {}
+
+        if page > 1:
+            links.update(prev=page - 1, first=1)
+
+        headers = dict(headers, Link=', '.join(
+            f'<{PUBLIC_URL}/search/repositories?{urlencode(dict(params, page=number))}>; rel="{rel}"'
+            for rel, number in links.items()))
+        self._send_json(200, {
+            'total_count': len(results),
+            'incomplete_results': False,
+            'items': results[(page - 1) * per_page:page * per_page]
+        }, headers)
+
+    def _send_json(self, status, body, headers=None):
+        body = json.dumps(body).encode()
+        headers = dict(headers or {})
+
+        if status == 200:
+            headers['ETag'] = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+            # Like GitHub, unchanged resources are answered with an empty 304
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, body = 304, b''
+
+                if self.rate_limit_key:
+                    rate_limiter.refund(*self.rate_limit_key)
+                    headers['X-RateLimit-Remaining'] = str(int(headers['X-RateLimit-Remaining']) + 1)
+
+        stats.count(self.path, status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Logging every request would slow the server down under load, see /_stats instead
+        pass
+
+
+class Stats:
+    """
+    Responses sent, by resource and status, served on /_stats.
+    """
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, path, status):
+        resource = 'search' if path.startswith('/search/') else 'core'
+
+        with self._lock:
+            self._counts[f'{resource}:{status}'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def _with_stars(repository, epoch):
+    repository = dict(repository, stargazers_count=repository['stargazers_count'] + repository['_growth'] * epoch)
+    del repository['_growth']
+
+    return repository
+
+
+def _get_epoch():
+    # Counted from the start of the server, so every run starts from the same data
+    return int((time.time() - STARTED_AT) // STAR_DRIFT_INTERVAL) if STAR_DRIFT_INTERVAL else 0
+
+
+def _format_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+repositories = Repositories(REPOSITORY_COUNT, SEED)
+rate_limiter = RateLimiter()
+stats = Stats()
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer((HOST, PORT), FakeGitHubHandler)
+    server.daemon_threads = True
+    print(f'Fake GitHub API serving {REPOSITORY_COUNT} repositories on {HOST}:{PORT}', flush=True)
+    server.serve_forever()
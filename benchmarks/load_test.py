@@ -0,0 +1,473 @@
+####################################################
+# Load generator for the three services.           #
+# Virtual users sign up, then run a weighted mix   #
+# of requests (see WORKLOADS) for a while. The     #
+# throughput and latency percentiles of every      #
+# endpoint are reported, and can be saved as a     #
+# baseline that later runs are compared against.   #
+####################################################
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import requests
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# Relative weights of the actions each virtual user picks from
+WORKLOADS = {
+    'mixed': {
+        'top_repos': 40,
+        'top_repos_ranking': 10,
+        'top_repos_fields': 5,
+        'ranking_changes': 5,
+        'repositories_by_ids': 5,
+        'favorites_get': 15,
+        'favorites_add': 8,
+        'favorites_remove': 6,
+        'favorites_bulk': 3,
+        'login': 3
+    },
+    'read_heavy': {
+        'top_repos': 60,
+        'top_repos_ranking': 15,
+        'top_repos_fields': 10,
+        'favorites_get': 15
+    },
+    'favorites': {
+        'favorites_get': 40,
+        'favorites_add': 25,
+        'favorites_remove': 20,
+        'favorites_bulk': 15
+    },
+    'auth': {
+        'login': 80,
+        'signup': 20
+    }
+}
+
+# Rankings requested by top_repos_ranking, some precomputed by the service, some not
+RANKINGS = [
+    {'sort': 'forks'},
+    {'sort': 'updated'},
+    {'language': 'python'},
+    {'language': 'go'},
+    {'language': 'ruby', 'limit': 50},
+    {'topic': 'machine-learning'},
+    {'limit': 1000}
+]
+
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    """
+    Collects the latency and status of every request, by endpoint. Requests sent before
+    the end of the warm up are not recorded.
+    """
+
+    def __init__(self, record_from):
+        self.record_from = record_from
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, started_at, status):
+        if started_at < self.record_from:
+            return
+
+        latency = time.perf_counter() - started_at
+
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+
+
+class VirtualUser:
+    """
+    A user of the application, with its own connections, account and favorites.
+    """
+
+    def __init__(self, options, recorder, run_id, index):
+        self.options = options
+        self.recorder = recorder
+        self.session = requests.Session()
+        self.email = f'bench-{run_id}-{index}@example.com'
+        self.password = uuid.uuid4().hex
+        self.token = None
+        self.repositories = []
+        self.favorite_ids = set()
+        self.ranking_version = None
+
+    def setup(self):
+        response = self._request('signup', 'POST', f'{self.options.auth_url}/signup',
+                                 json={'email': self.email, 'password': self.password})
+
+        if response is None or response.status_code != 201:
+            return False
+
+        self.token = response.json()['jwt_token']
+        response = self._request('top_repos', 'GET', f'{self.options.github_url}/top-starred-repositories')
+
+        if response is None or response.status_code != 200:
+            return False
+
+        self.repositories = response.json()
+
+        return bool(self.repositories)
+
+    def run(self, weights, deadline):
+        actions = list(weights)
+        action_weights = [weights[action] for action in actions]
+
+        while time.perf_counter() < deadline:
+            getattr(self, random.choices(actions, action_weights)[0])()
+
+            if self.options.think_time:
+                time.sleep(random.uniform(0, 2 * self.options.think_time))
+
+    def top_repos(self):
+        response = self._request('top_repos', 'GET', f'{self.options.github_url}/top-starred-repositories')
+
+        if response is not None and 'X-Ranking-Version' in response.headers:
+            self.ranking_version = response.headers['X-Ranking-Version']
+
+    def top_repos_ranking(self):
+        self._request('top_repos_ranking', 'GET', f'{self.options.github_url}/top-starred-repositories',
+                      params=random.choice(RANKINGS))
+
+    def top_repos_fields(self):
+        self._request('top_repos_fields', 'GET', f'{self.options.github_url}/top-starred-repositories',
+                      params={'fields': 'id,name,stars'})
+
+    def ranking_changes(self):
+        if self.ranking_version is None:
+            return self.top_repos()
+
+        self._request('ranking_changes', 'GET', f'{self.options.github_url}/top-starred-repositories/changes',
+                      params={'since': max(int(self.ranking_version) - 1, 0)})
+
+    def repositories_by_ids(self):
+        ids = [str(repository['id']) for repository in random.sample(self.repositories, min(20, len(self.repositories)))]
+        self._request('repositories_by_ids', 'GET', f'{self.options.github_url}/repositories',
+                      params={'ids': ','.join(ids)})
+
+    def favorites_get(self):
+        self._request('favorites_get', 'GET', f'{self.options.favorites_url}/favorites', authenticated=True)
+
+    def favorites_add(self):
+        repository = random.choice(self.repositories)
+        response = self._request('favorites_add', 'POST', f'{self.options.favorites_url}/favorites',
+                                 json={'repository': repository}, authenticated=True)
+
+        if response is not None and response.status_code in (201, 400):
+            self.favorite_ids.add(str(repository['id']))
+
+    def favorites_remove(self):
+        if not self.favorite_ids:
+            return self.favorites_add()
+
+        repository_id = random.choice(sorted(self.favorite_ids))
+        response = self._request('favorites_remove', 'DELETE', f'{self.options.favorites_url}/favorites',
+                                 params={'repository_id': repository_id}, authenticated=True)
+
+        if response is not None and response.status_code in (200, 400):
+            self.favorite_ids.discard(repository_id)
+
+    def favorites_bulk(self):
+        repositories = random.sample(self.repositories, min(10, len(self.repositories)))
+        operations = [{'action': 'remove', 'repository_id': str(repository['id'])}
+                      if str(repository['id']) in self.favorite_ids else {'action': 'add', 'repository': repository}
+                      for repository in repositories]
+        response = self._request('favorites_bulk', 'POST', f'{self.options.favorites_url}/favorites/bulk',
+                                 json={'operations': operations}, authenticated=True)
+
+        if response is not None and response.status_code == 200:
+            for result in response.json()['results']:
+                if result['result'] in ('added', 'already_present'):
+                    self.favorite_ids.add(result['repository_id'])
+                elif result['result'] in ('removed', 'missing'):
+                    self.favorite_ids.discard(result['repository_id'])
+
+    def login(self):
+        response = self._request('login', 'POST', f'{self.options.auth_url}/login',
+                                 json={'email': self.email, 'password': self.password})
+
+        if response is not None and response.status_code == 200:
+            self.token = response.json()['jwt_token']
+
+    def signup(self):
+        self._request('signup', 'POST', f'{self.options.auth_url}/signup',
+                      json={'email': f'bench-{uuid.uuid4().hex}@example.com', 'password': self.password})
+
+    def _request(self, endpoint, method, url, authenticated=False, **kwargs):
+        """
+        Sends a request and records it. Returns the response, or None if it could not be sent.
+        """
+        headers = {'Authorization': self.token} if authenticated else {}
+        started_at = time.perf_counter()
+
+        try:
+            response = self.session.request(method, url, headers=headers, timeout=self.options.timeout, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(endpoint, started_at, 'error')
+
+            return None
+
+        self.recorder.record(endpoint, started_at, response.status_code)
+
+        return response
+
+
+def run(options):
+    """
+    Runs a workload, and returns its results (see summarize).
+    """
+    run_id = uuid.uuid4().hex[:8]
+    # Accounts are created before the clock starts, signup is measured by the 'auth' workload
+    setup_recorder = Recorder(record_from=float('inf'))
+    users = [VirtualUser(options, setup_recorder, run_id, index) for index in range(options.users)]
+
+    print(f'Signing up {len(users)} virtual users...')
+
+    for user in users:
+        if not user.setup():
+            sys.exit('Failed to set up a virtual user, are the services running?')
+
+    github_stats_before = _get_fake_github_stats(options)
+    started_at = time.perf_counter()
+    recorder = Recorder(record_from=started_at + options.warmup)
+    deadline = started_at + options.warmup + options.duration
+
+    for user in users:
+        user.recorder = recorder
+
+    print(f"Running the '{options.workload}' workload for {options.warmup}s of warm up "
+          f"and {options.duration}s of measurement...")
+    threads = [threading.Thread(target=user.run, args=(WORKLOADS[options.workload], deadline), daemon=True)
+               for user in users]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    results = summarize(recorder, options.duration)
+    results.update(
+        workload=options.workload,
+        users=options.users,
+        duration=options.duration,
+        created_at=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        commit=_get_commit())
+    github_stats_after = _get_fake_github_stats(options)
+
+    if github_stats_before is not None and github_stats_after is not None:
+        results['github_requests'] = {key: count - github_stats_before.get(key, 0)
+                                      for key, count in github_stats_after.items()
+                                      if count != github_stats_before.get(key, 0)}
+
+    return results
+
+
+def summarize(recorder, duration):
+    """
+    Returns:
+        dict: The results of a run, with an 'endpoints' dict of the requests, errors (transport errors,
+              429s and 5xx), throughput and latency percentiles (in ms) of every endpoint,
+              and the same over every request as 'total'.
+    """
+    endpoints = {}
+    all_latencies = []
+    all_statuses = Counter()
+
+    for endpoint in sorted(recorder.latencies):
+        latencies = recorder.latencies[endpoint]
+        all_latencies.extend(latencies)
+        all_statuses.update(recorder.statuses[endpoint])
+        endpoints[endpoint] = _summarize_requests(latencies, recorder.statuses[endpoint], duration)
+
+    return {
+        'endpoints': endpoints,
+        'total': _summarize_requests(all_latencies, all_statuses, duration)
+    }
+
+
+def _summarize_requests(latencies, statuses, duration):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items()
+                      if status == 'error' or status == 429 or status >= 500),
+        'throughput': round(len(latencies) / duration, 2),
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else None
+    }
+
+    for percentile in PERCENTILES:
+        summary[f'p{percentile}_ms'] = round(_percentile(latencies, percentile) * 1000, 2) if latencies else None
+
+    return summary
+
+
+def _percentile(sorted_values, percentile):
+    # Nearest rank
+    return sorted_values[max(math.ceil(percentile / 100 * len(sorted_values)) - 1, 0)]
+
+
+def print_results(results):
+    columns = ('requests', 'errors', 'throughput') + tuple(f'p{percentile}_ms' for percentile in PERCENTILES) \
+        + ('max_ms',)
+    print()
+    print(f"{'endpoint':<22}" + ''.join(f'{column:>12}' for column in columns))
+
+    for endpoint, summary in list(results['endpoints'].items()) + [('total', results['total'])]:
+        print(f'{endpoint:<22}' + ''.join(f'{_format(summary[column]):>12}' for column in columns))
+
+    if 'github_requests' in results:
+        print(f"\nGitHub API requests during the run: {json.dumps(results['github_requests'])}")
+
+
+def compare(results, baseline, max_regression):
+    """
+    Prints how a run compares to a baseline, endpoint by endpoint.
+
+    Returns:
+        list: The regressions, as (endpoint, metric, baseline value, value). A latency percentile regresses when it
+              grows by more than max_regression (a fraction) and at least 1 ms, throughput when it drops by more
+              than max_regression, and errors whenever there are more of them.
+    """
+    regressions = []
+    print(f"\nCompared to the baseline of {baseline.get('created_at')} (commit {baseline.get('commit')}):")
+
+    for endpoint, summary in list(results['endpoints'].items()) + [('total', results['total'])]:
+        previous = baseline['total'] if endpoint == 'total' else baseline['endpoints'].get(endpoint)
+
+        if previous is None:
+            print(f'{endpoint:<22} not in the baseline')
+
+            continue
+
+        changes = []
+
+        for metric in tuple(f'p{percentile}_ms' for percentile in PERCENTILES) + ('throughput', 'errors'):
+            before, after = previous.get(metric), summary.get(metric)
+
+            if before is None or after is None:
+                continue
+
+            if metric == 'throughput':
+                regressed = after < before * (1 - max_regression)
+            elif metric == 'errors':
+                regressed = after > before
+            else:
+                regressed = after > before * (1 + max_regression) and after - before >= 1
+
+            change = f'{(after - before) / before:+.0%}' if before else f'{after - before:+}'
+            changes.append(f"{metric} {_format(before)} -> {_format(after)} ({change}){' !' if regressed else ''}")
+
+            if regressed:
+                regressions.append((endpoint, metric, before, after))
+
+        print(f'{endpoint:<22} ' + ', '.join(changes))
+
+    return regressions
+
+
+def _format(value):
+    return '-' if value is None else str(value)
+
+
+def _get_fake_github_stats(options):
+    if not options.fake_github_url:
+        return None
+
+    try:
+        return requests.get(f'{options.fake_github_url}/_stats', timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _get_baseline_path(name):
+    return os.path.join(BASELINES_DIR, f'{name}.json')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test the services, and compare the results with a baseline.')
+    parser.add_argument('--workload', choices=sorted(WORKLOADS), default='mixed')
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users (default: 20)')
+    parser.add_argument('--duration', type=int, default=60, help='seconds of measurement (default: 60)')
+    parser.add_argument('--warmup', type=int, default=10, help='seconds of unmeasured warm up (default: 10)')
+    parser.add_argument('--think-time', type=float, default=0,
+                        help="average seconds a user waits between requests (default: 0, as fast as possible)")
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request fails (default: 30)')
+    parser.add_argument('--seed', type=int, help='random seed of the request mix')
+    parser.add_argument('--github-url', default='http://localhost:8080/github')
+    parser.add_argument('--auth-url', default='http://localhost:8081/auth')
+    parser.add_argument('--favorites-url', default='http://localhost:8082')
+    parser.add_argument('--fake-github-url', default='http://localhost:9090',
+                        help="fake GitHub API, to report the requests the services made to it ('' to skip)")
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--save-baseline', metavar='NAME', help='save the results as baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare the results with baselines/NAME.json')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='fraction a metric may worsen by before it counts as a regression (default: 0.2)')
+
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    baseline = None
+
+    if options.seed is not None:
+        random.seed(options.seed)
+
+    if options.compare:
+        # Fail before the run, not after it
+        with open(_get_baseline_path(options.compare)) as file:
+            baseline = json.load(file)
+
+        if baseline['workload'] != options.workload:
+            sys.exit(f"Baseline {options.compare} was recorded with the '{baseline['workload']}' workload")
+
+    results = run(options)
+    print_results(results)
+
+    for path in filter(None, [options.output, options.save_baseline and _get_baseline_path(options.save_baseline)]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+        print(f'\nSaved the results to {path}')
+
+    if baseline is not None:
+        regressions = compare(results, baseline, options.max_regression)
+
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) past {options.max_regression:.0%}')
+            sys.exit(1)
+
+        print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+####################################################
+# Admission control shared by the services.        #
+# Rate limits are token buckets in Redis, shared   #
+# by every worker, configured per route in         #
+# RATE_LIMITS and keyed by the JWT user ID or the  #
+# client IP. Requests past them get a 429 with     #
+# Retry-After. Each worker also caps the requests  #
+# it handles at once, and refuses the rest with a  #
+# 503 right away instead of queueing them behind   #
+# slow calls.                                      #
+####################################################
+
+import math
+import threading
+from functools import wraps
+from flask import g, jsonify, request, current_app as app
+
+from utils.app_logging import logger
+from utils.metrics import count_rejection
+from utils.redis_manager import get_redis_client, take_rate_limit_tokens
+
+# Endpoints that are always admitted, so an overloaded worker can still be observed
+EXEMPT_ENDPOINTS = ('metrics',)
+
+
+def init_admission_control(app):
+    """
+    Caps the requests each worker of an app handles at once to its ADMISSION_MAX_CONCURRENT_REQUESTS setting.
+
+    Requests past the cap are refused with a 503 and Retry-After. A cap of 0 disables it.
+    The app's RATE_LIMITS are checked here too, so a bad limit fails at startup rather than on a request.
+
+    Args:
+        app (flask.Flask): The application.
+
+    Raises:
+        ValueError: If a rate limit's rate isn't positive, or its burst is less than 1.
+    """
+    for name, limit in app.config.get('RATE_LIMITS', {}).items():
+        # The token bucket script divides by the rate
+        if limit['rate'] <= 0 or limit['burst'] < 1:
+            raise ValueError(f"Invalid rate limit {name}, its rate should be positive and its burst at least 1")
+
+    max_concurrent_requests = app.config['ADMISSION_MAX_CONCURRENT_REQUESTS']
+
+    if not max_concurrent_requests:
+        return
+
+    # Created before gunicorn forks the workers, so each worker starts with a full semaphore of its own
+    slots = threading.BoundedSemaphore(max_concurrent_requests)
+
+    @app.before_request
+    def admit_request():
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        if not slots.acquire(blocking=False):
+            count_rejection('concurrency', 'overloaded')
+            logger.warning(f"Refused {request.method} {request.path}, "
+                           f"{max_concurrent_requests} requests are already being handled",
+                           extra={'log_key': 'admission_overloaded'})
+
+            return _server_busy()
+
+        g.admitted = True
+
+        return None
+
+    @app.teardown_request
+    def release_slot(error):
+        # Streamed responses are torn down once they are sent
+        if g.pop('admitted', False):
+            slots.release()
+
+
+def rate_limit(name):
+    """
+    Decorator that applies the RATE_LIMITS[name] rate limit to a view.
+
+    The limit is a dict with the following keys:
+        - rate (float): Requests per second allowed, sustained.
+        - burst (int): Requests allowed at once, after a quiet period.
+        - key (str): 'user' to limit each user (by the user ID of their JWT, so require_auth must run first),
+                     or 'ip' to limit each client IP.
+
+    Requests past the limit get a 429 with a Retry-After header. Views without a configured limit,
+    or with RATE_LIMITS_ENABLED off, are not limited. If Redis can't be reached, requests are let through.
+
+    Args:
+        name (str): The rate limit's name in RATE_LIMITS. Views sharing a name share the limit.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limit = app.config['RATE_LIMITS'].get(name)
+
+            if not app.config['RATE_LIMITS_ENABLED'] or limit is None:
+                return view(*args, **kwargs)
+
+            client = get_redis_client()
+
+            if client is None:
+                return view(*args, **kwargs)
+
+            allowed, retry_after = take_rate_limit_tokens(
+                client, f"rate_limit:{name}:{_get_client_key(limit['key'])}", limit['rate'], limit['burst'])
+
+            if not allowed:
+                count_rejection(name, 'rate_limited')
+                response = jsonify({'error': 'Too many requests, try again later'})
+                response.headers['Retry-After'] = str(max(math.ceil(retry_after), 1))
+
+                return response, 429
+
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _get_client_key(key):
+    """
+    Returns who a request counts against: its user for 'user' limits (its IP if it isn't authenticated),
+    its client IP otherwise.
+    """
+    user_id = g.get('user_id')
+
+    if key == 'user' and user_id:
+        return f"user:{user_id}"
+
+    # The services are exposed directly. Behind a proxy, remote_addr must be fixed up (e.g. werkzeug's ProxyFix).
+    return f"ip:{request.remote_addr}"
+
+
+def _server_busy():
+    response = jsonify({'error': 'Server is busy, try again later'})
+    response.headers['Retry-After'] = '1'
+
+    return response, 503
@@ -1,48 +1,259 @@
 ####################################################
 # This file encapsulates the logger configuration. #
-# A rotating file handler is employed for logging  #
-# in this project, serving as a pragmatic choice   #
-# given the time constraints. While alternative    #
-# logging handlers, like those sending logs to     #
-# databases such as Elasticsearch or message       #
-# queues like Kafka, could have been utilized to   #
-# enhance log management and analysis, the         #
-# integration of such technologies was deferred    #
-# due to the limited time available. This          #
-# approach enables a balance between functionality #
-# and development efficiency, ensuring adequate    #
-# logging capabilities for the current scope of    #
-# the project.                                     #
+# Records are written to a rotating file and to    #
+# stdout by a background listener thread: request  #
+# threads only put them on a bounded queue, and    #
+# records are dropped rather than waited for when  #
+# the queue is full. Records are JSON, with the    #
+# ID of the request they were logged from, and     #
+# each logging call site is rate limited, so an    #
+# error storm can't flood the logs or slow down    #
+# requests. Everything is configured with env vars #
+# (LOG_*), so each service sets its own level.     #
 ####################################################
 
 
+import atexit
+import contextvars
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
 import sys
+import threading
+import time
+import uuid
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 MAX_BYTES = 1024 * 1024
 BACKUP_COUNT = 5
 LOG_FILE_PATH = './logs/service.log'
 
+SERVICE_NAME = os.environ.get('SERVICE_NAME', 'app')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_QUEUE_ENABLED = os.environ.get('LOG_QUEUE_ENABLED', 'true').lower() == 'true'
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # records waiting for the listener
+# Each call site (or extra={'log_key': ...}) may log LOG_RATE_LIMIT records per LOG_RATE_LIMIT_INTERVAL seconds.
+# Past that, only a LOG_SAMPLE_RATE fraction of its records is kept. CRITICAL records are never limited.
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', 20))
+LOG_RATE_LIMIT_INTERVAL = float(os.environ.get('LOG_RATE_LIMIT_INTERVAL', 10))
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_exception_formatter = logging.Formatter()
+
+# ID of the request being handled by the current thread (or greenlet)
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def get_request_id():
+    """
+    Returns the ID of the request being handled, or None outside of a request.
+    """
+    return _request_id.get()
+
+
+def set_request_id(request_id):
+    _request_id.set(request_id)
+
+
+def init_request_logging(app):
+    """
+    Tags the records logged while handling a request with its ID.
+
+    The ID is taken from the X-Request-ID header, so a request can be followed across services,
+    or generated if missing. It is sent back in the response's X-Request-ID header.
+
+    Args:
+        app (flask.Flask): The application.
+    """
+    from flask import request
+
+    @app.before_request
+    def assign_request_id():
+        set_request_id(request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex)
+
+    @app.after_request
+    def return_request_id(response):
+        response.headers[REQUEST_ID_HEADER] = get_request_id()
+
+        return response
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the ID of the current request to records, as record.request_id.
+    """
+
+    def filter(self, record):
+        record.request_id = get_request_id()
+
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits the records of each message key to `rate` per `interval` seconds, then keeps a `sample_rate` fraction.
+
+    The key of a record is its log_key extra if given, otherwise its call site. The first record kept
+    after some were dropped tells how many, as record.suppressed.
+    """
+
+    def __init__(self, rate, interval, sample_rate, max_level=logging.ERROR):
+        super().__init__()
+        self.rate = rate
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.max_level = max_level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+
+        key = getattr(record, 'log_key', None) or (record.pathname, record.lineno)
+        now = time.monotonic()
+
+        with self._lock:
+            window = self._windows.get(key)
+
+            if window is None or now - window[0] >= self.interval:
+                window = self._windows[key] = [now, 0, window[2] if window else 0]
+
+            window[1] += 1
+
+            if window[1] > self.rate and random.random() >= self.sample_rate:
+                window[2] += 1
+
+                return False
+
+            record.suppressed = window[2]
+            window[2] = 0
+
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single line JSON objects.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'service': SERVICE_NAME,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'thread': record.threadName
+        }
+
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records when the queue is full, instead of blocking or raising.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only resolve the message and the exception here, formatting is left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _create_handlers():
+    """
+    Returns the handlers that write records: a rotating file and stdout.
+    """
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(request_id)s - %(message)s')
+
+    # Create file handler
+    file_handler = RotatingFileHandler(
+        LOG_FILE_PATH, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+    file_handler.setLevel(logging.INFO)
+
+    # Create stream handler
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setLevel(logging.DEBUG)
+
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+
+    return [file_handler, stream_handler]
+
+
+def _start_listener():
+    """
+    Starts the listener thread that writes the queued records, with a new queue.
+    Also called in forked children, which don't inherit the parent's thread.
+    """
+    global _listener
+
+    queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    """
+    Writes the records left in the queue, and stops the listener thread.
+    """
+    if _listener is not None:
+        _listener.stop()
+
+
 # Create logger
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# Create file handler
-file_handler = RotatingFileHandler(
-    LOG_FILE_PATH, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
-file_handler.setLevel(logging.INFO)
-
-# Create stream handler
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setLevel(logging.DEBUG)
-
-# Create formatter and add it to the handlers
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-stream_handler.setFormatter(formatter)
-
-# Add the handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+logger.setLevel(LOG_LEVEL)
+logger.addFilter(RequestIdFilter())
+logger.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_LIMIT_INTERVAL, LOG_SAMPLE_RATE))
+
+handlers = _create_handlers()
+queue_handler = None
+_listener = None
+
+if LOG_QUEUE_ENABLED:
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    logger.addHandler(queue_handler)
+    _start_listener()
+    os.register_at_fork(after_in_child=_start_listener)
+    atexit.register(_stop_listener)
+else:
+    for handler in handlers:
+        logger.addHandler(handler)
@@ -1,20 +1,45 @@
+import atexit
+import os
+import threading
+import time
 from pymongo import MongoClient
 from pymongo.errors import PyMongoError
 from utils.app_logging import logger
-
-
-def create_mongo_client(uri):
+from utils.metrics import MONGO_LISTENERS
+
+# Maps app config keys to the MongoClient pool and timeout options they control.
+CLIENT_OPTIONS_CONFIG = {
+    'DB_MAX_POOL_SIZE': 'maxPoolSize',
+    'DB_MIN_POOL_SIZE': 'minPoolSize',
+    'DB_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'DB_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+    'DB_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'DB_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'DB_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+}
+
+# Process-wide registry of pooled clients, keyed by URI.
+# MongoClient is not fork-safe, so the registry remembers the pid that owns it.
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+
+def create_mongo_client(uri, **options):
     """
     Creates a MongoClient instance using the provided URI.
 
     Args:
         uri (str): The URI to connect to the MongoDB instance.
+        **options: Extra keyword arguments passed to MongoClient (pool sizes, timeouts, etc.).
 
     Returns:
         MongoClient: A MongoClient instance if the connection is successful, otherwise None.
     """
     try:
-        client = MongoClient(uri)
+        # Time every command and track the pool's connections, see metrics.py
+        options.setdefault('event_listeners', MONGO_LISTENERS)
+        client = MongoClient(uri, **options)
 
         return client
     except ConnectionError as e:
@@ -27,6 +52,75 @@ def create_mongo_client(uri):
         return None
 
 
+def get_client_options(config):
+    """
+    Build MongoClient keyword arguments from an app config mapping.
+
+    Args:
+        config (dict): The app config. Only the keys listed in CLIENT_OPTIONS_CONFIG are used.
+
+    Returns:
+        dict: MongoClient options for the keys that are set in the config.
+    """
+    return {option: config[key] for key, option in CLIENT_OPTIONS_CONFIG.items()
+            if config.get(key) is not None}
+
+
+def get_mongo_client(uri, **options):
+    """
+    Get the pooled MongoClient for the given URI, creating it on first use.
+
+    The client is shared by every caller in the current process, so requests reuse
+    already established (and authenticated) connections instead of opening new ones.
+    After a fork, the inherited clients are dropped and new ones are created lazily.
+
+    Args:
+        uri (str): The URI to connect to the MongoDB instance.
+        **options: MongoClient options, only used when the client is first created.
+
+    Returns:
+        MongoClient: The shared MongoClient instance, or None if it could not be created.
+    """
+    global _clients_pid
+
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            # Inherited from the parent process. These clients must not be used
+            # or closed in the child, so just forget about them.
+            _clients.clear()
+            _clients_pid = os.getpid()
+
+        client = _clients.get(uri)
+
+        if client is None:
+            client = create_mongo_client(uri, **options)
+
+            if client is not None:
+                _clients[uri] = client
+                logger.info(f"Created pooled MongoClient. Options: {options}")
+
+        return client
+
+
+def close_all_clients():
+    """
+    Close every pooled MongoClient owned by the current process.
+    """
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+
+            return
+
+        for client in _clients.values():
+            close_client(client)
+
+        _clients.clear()
+
+
+atexit.register(close_all_clients)
+
+
 def get_database(client, db_name):
     """
     Get a database from a MongoDB client.
@@ -88,3 +182,73 @@ def close_client(client):
         client.close()
     except Exception as e:
         logger.error(f"Failed to close MongoClient. Error: {e}")
+
+
+def ensure_indexes(collection, indexes, progress_interval=5):
+    """
+    Create the given indexes on a collection if they are missing, and check that they exist.
+
+    Creating an index that already exists with the same options is a no-op, so this can run on
+    every startup. While a new index is being built, its progress is logged every `progress_interval` seconds.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection to index.
+        indexes (list): pymongo.IndexModel instances. Each must have a name.
+        progress_interval (int, optional): Seconds between build progress reports. Defaults to 5.
+
+    Returns:
+        bool: True if every index exists, False otherwise.
+    """
+    names = [index.document['name'] for index in indexes]
+    logger.info(f"Ensuring indexes {names} on {collection.full_name}")
+    started_at = time.monotonic()
+    build_done = threading.Event()
+    reporter = threading.Thread(
+        target=_report_index_builds, args=(collection, build_done, progress_interval), daemon=True)
+    reporter.start()
+
+    try:
+        collection.create_indexes(indexes)
+    except PyMongoError as e:
+        logger.error(f"Failed to create indexes on {collection.full_name}. Error: {e}")
+    finally:
+        build_done.set()
+
+    try:
+        existing = collection.index_information()
+    except PyMongoError as e:
+        logger.error(f"Failed to list indexes of {collection.full_name}. Error: {e}")
+
+        return False
+
+    missing = [name for name in names if name not in existing]
+
+    if missing:
+        logger.error(f"Indexes {missing} are missing on {collection.full_name}")
+
+        return False
+
+    logger.info(
+        f"Indexes {names} on {collection.full_name} are ready. Took {time.monotonic() - started_at:.1f} seconds")
+
+    return True
+
+
+def _report_index_builds(collection, build_done, interval):
+    """
+    Logs the progress of index builds running on a collection, until `build_done` is set.
+    """
+    while not build_done.wait(interval):
+        try:
+            operations = collection.database.client.admin.command(
+                {'currentOp': 1, 'command.createIndexes': collection.name})['inprog']
+        except PyMongoError as e:
+            logger.warning(f"Failed to get index build progress. Error: {e}")
+
+            return
+
+        for operation in operations:
+            progress = operation.get('progress', {})
+            logger.info(
+                f"Building indexes on {collection.full_name}: {operation.get('msg', 'in progress')} "
+                f"({progress.get('done', '?')}/{progress.get('total', '?')})")
@@ -0,0 +1,65 @@
+#####################################################
+# Gunicorn configuration shared by all services.    #
+# Every setting can be overridden with an env var.  #
+#                                                   #
+# The default gthread workers serve WEB_THREADS     #
+# requests each, so one slow call to Mongo, Redis   #
+# or GitHub holds a thread, not the whole worker.   #
+# Set WEB_WORKER_CLASS=gevent for cooperative I/O,  #
+# with up to WEB_WORKER_CONNECTIONS concurrent      #
+# requests per worker.                              #
+#####################################################
+
+import importlib.util
+import multiprocessing
+import os
+import shutil
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 8080)}"
+
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('WEB_THREADS', 8))
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+# gthread workers queue the connections they accept (up to worker_connections) for their threads, and the
+# kernel queues up to backlog more. Lower them to shed load sooner, rather than let requests wait.
+backlog = int(os.environ.get('WEB_BACKLOG', 2048))
+
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+# Recycle workers now and then, so a slow leak can't grow forever
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('WEB_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # One-off startup tasks (e.g. creating indexes) of the services that have them, see bootstrap.py.
+    # They run here, once, rather than in every worker as it loads the app.
+    if importlib.util.find_spec('bootstrap') is not None:
+        import bootstrap
+
+        bootstrap.run()
+
+    # Metrics files left by a previous run, or by the startup tasks, would be added to the new workers' values
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges (pending calls, open connections) of a worker that is gone
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
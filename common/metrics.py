@@ -0,0 +1,205 @@
+####################################################
+# Prometheus metrics shared by all services.       #
+# Calls to dependencies (MongoDB, Redis, GitHub,   #
+# bcrypt, ...) are timed and their errors counted, #
+# along with cache lookups, pool utilization and   #
+# HTTP requests. Served on /metrics.               #
+#                                                  #
+# Under gunicorn, every worker writes its values   #
+# to PROMETHEUS_MULTIPROC_DIR, and /metrics sums   #
+# them, whichever worker answers the scrape.       #
+####################################################
+
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess
+from pymongo import monitoring
+
+from utils.profiling import record_span
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# Latency buckets in seconds, from cache hits to slow GitHub searches
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+DEPENDENCY_LATENCY = Histogram(
+    'dependency_request_duration_seconds', 'Latency of calls to dependencies',
+    ['dependency', 'operation'], buckets=LATENCY_BUCKETS)
+DEPENDENCY_ERRORS = Counter(
+    'dependency_errors_total', 'Failed calls to dependencies', ['dependency', 'operation'])
+DEPENDENCY_PENDING = Gauge(
+    'dependency_pending_requests', 'Calls to dependencies waiting for a result',
+    ['dependency'], multiprocess_mode='livesum')
+POOL_CONNECTIONS = Gauge(
+    'dependency_pool_connections', 'Connections of dependency pools, by state (open or checked_out)',
+    ['dependency', 'state'], multiprocess_mode='livesum')
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups, by result (hit or miss)', ['cache', 'result'])
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections_total', 'Requests refused by a rate limit (rate_limited) or a concurrency cap (overloaded)',
+    ['limit', 'reason'])
+PASSWORD_HASHING_COST = Gauge(
+    'password_hashing_cost_factor', 'bcrypt cost factor (log2 of the rounds) of new password hashes',
+    multiprocess_mode='livemax')
+HTTP_REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Latency of the requests served',
+    ['method', 'endpoint', 'status'], buckets=LATENCY_BUCKETS)
+
+
+@contextmanager
+def observe(dependency, operation):
+    """
+    Times a call to a dependency, and counts it as an error if it raises.
+
+    Args:
+        dependency (str): The dependency called, e.g. 'redis'.
+        operation (str): The operation, e.g. 'get'.
+    """
+    started_at = time.perf_counter()
+
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+
+        raise
+    finally:
+        duration = time.perf_counter() - started_at
+        DEPENDENCY_LATENCY.labels(dependency, operation).observe(duration)
+        record_span(dependency, operation, duration)
+
+
+def count_error(dependency, operation):
+    """
+    Counts a failed call to a dependency that didn't raise, e.g. an error response.
+    """
+    DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+
+
+def count_cache_lookup(cache, hit):
+    """
+    Counts a cache lookup. The hit ratio is hits / (hits + misses).
+    """
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def count_rejection(limit, reason):
+    """
+    Counts a request refused by admission control.
+
+    Args:
+        limit (str): The rate limit or concurrency cap that refused it.
+        reason (str): 'rate_limited' or 'overloaded'.
+    """
+    ADMISSION_REJECTIONS.labels(limit, reason).inc()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Times every MongoDB command, by command name.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._observe(event)
+
+    def failed(self, event):
+        self._observe(event)
+        DEPENDENCY_ERRORS.labels('mongodb', event.command_name).inc()
+
+    def _observe(self, event):
+        # Listeners are called on the thread that ran the command, so the span lands in its request's profile
+        duration = event.duration_micros / 1e6
+        DEPENDENCY_LATENCY.labels('mongodb', event.command_name).observe(duration)
+        record_span('mongodb', event.command_name, duration)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Tracks the open and checked out connections of MongoDB connection pools.
+    """
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.labels('mongodb', 'open').inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.labels('mongodb', 'open').dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        DEPENDENCY_ERRORS.labels('mongodb', 'check_out').inc()
+
+    def connection_checked_out(self, event):
+        POOL_CONNECTIONS.labels('mongodb', 'checked_out').inc()
+
+    def connection_checked_in(self, event):
+        POOL_CONNECTIONS.labels('mongodb', 'checked_out').dec()
+
+
+MONGO_LISTENERS = [MongoCommandListener(), MongoPoolListener()]
+
+
+def init_metrics(app):
+    """
+    Times the requests served by an app, and serves the metrics on /metrics.
+
+    Args:
+        app (flask.Flask): The application.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started_at = g.pop('request_started_at', None)
+
+        if started_at is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_LATENCY.labels(request.method, endpoint, response.status_code).observe(
+                time.perf_counter() - started_at)
+
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(generate_latest(_get_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _get_registry():
+    """
+    Returns the registry to serve: the values of every worker in multiprocess mode, this process' otherwise.
+    """
+    if not MULTIPROC_DIR:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+
+    return registry
@@ -0,0 +1,287 @@
+####################################################
+# Per-request profiling and slow request capture.  #
+# Every request records a span per dependency call #
+# (see metrics.observe). Profiled requests - all   #
+# of them, a sample, or those sent by a trusted    #
+# caller with the X-Profile header - also get a    #
+# sampled stack profile. Profiled and slow         #
+# requests are dumped as JSON to a bounded ring    #
+# buffer of files in PROFILING_DUMP_DIR.           #
+####################################################
+
+import contextvars
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from utils.app_logging import logger, get_request_id
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# Frames kept per sampled stack, innermost last
+MAX_STACK_DEPTH = 40
+# Distinct stacks kept in a dump, the most sampled first
+MAX_DUMPED_STACKS = 50
+
+# Profile of the request being handled by the current thread
+_current_profile = contextvars.ContextVar('profile', default=None)
+
+_sampler = None
+_sampler_pid = None
+_sampler_lock = threading.Lock()
+_dump_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    The spans and stack samples of a request.
+
+    Args:
+        reason (str or None): Why the request is profiled ('config', 'sampled' or 'header'),
+            or None if it only records spans, in case it turns out slow.
+    """
+
+    def __init__(self, reason):
+        self.reason = reason
+        self.started_at = time.perf_counter()
+        self.wall_started_at = time.time()
+        self.thread_id = threading.get_ident()
+        self.spans = []
+        self.stacks = Counter()
+
+    def add_span(self, dependency, operation, duration):
+        end = time.perf_counter() - self.started_at
+        self.spans.append((dependency, operation, end - duration, duration))
+
+    def to_dict(self, duration):
+        totals = Counter()
+
+        for dependency, _, _, span_duration in self.spans:
+            totals[dependency] += span_duration
+
+        return {
+            'started_at': self.wall_started_at,
+            'duration_ms': round(duration * 1000, 3),
+            'reason': self.reason,
+            'span_totals_ms': {dependency: round(total * 1000, 3) for dependency, total in totals.items()},
+            'spans': [{'dependency': dependency, 'operation': operation,
+                       'start_ms': round(start * 1000, 3), 'duration_ms': round(span_duration * 1000, 3)}
+                      for dependency, operation, start, span_duration in self.spans],
+            'stacks': dict(self.stacks.most_common(MAX_DUMPED_STACKS))
+        }
+
+
+class StackSampler:
+    """
+    Background thread that samples the stacks of the threads handling profiled requests.
+
+    Stacks are read with sys._current_frames, so only OS threads are seen: under gevent workers,
+    the samples show the hub rather than the request's greenlet.
+
+    Args:
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._profiles = {}
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        thread.start()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile.thread_id] = profile
+
+    def remove(self, profile):
+        """
+        Stops sampling a profile's thread.
+
+        Returns:
+            Counter: A copy of the profile's stacks, taken once the sampler can no longer change them.
+        """
+        with self._lock:
+            if self._profiles.get(profile.thread_id) is profile:
+                del self._profiles[profile.thread_id]
+
+            return Counter(profile.stacks)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            with self._lock:
+                profiles = list(self._profiles.values())
+
+            if not profiles:
+                continue
+
+            frames = sys._current_frames()
+            stacks = [(profile, _fold_stack(frames[profile.thread_id]))
+                      for profile in profiles if profile.thread_id in frames]
+
+            # Profiles removed in the meantime are being dumped, and must not change anymore
+            with self._lock:
+                for profile, stack in stacks:
+                    if self._profiles.get(profile.thread_id) is profile:
+                        profile.stacks[stack] += 1
+
+
+def record_span(dependency, operation, duration):
+    """
+    Adds a span to the profile of the current request, if any.
+
+    Args:
+        dependency (str): The dependency called, e.g. 'redis'.
+        operation (str): The operation, e.g. 'get'.
+        duration (float): The duration of the call, in seconds. The call is assumed to have just ended.
+    """
+    profile = _current_profile.get()
+
+    if profile is not None:
+        profile.add_span(dependency, operation, duration)
+
+
+def init_profiling(app):
+    """
+    Profiles the requests served by an app, as configured by its PROFILING_* settings.
+
+    Args:
+        app (flask.Flask): The application.
+    """
+    from flask import request
+
+    config = app.config
+
+    if not config['PROFILING_SLOW_REQUEST_MS'] and not config['PROFILING_ENABLED'] \
+            and not config['PROFILING_SAMPLE_RATE'] and not config['PROFILING_TOKEN']:
+        return
+
+    @app.before_request
+    def start_profile():
+        profile = RequestProfile(_get_profile_reason(config, request.headers.get(PROFILE_HEADER)))
+        _current_profile.set(profile)
+
+        if profile.reason is not None:
+            _get_sampler(config['PROFILING_SAMPLE_INTERVAL']).add(profile)
+
+    @app.after_request
+    def finish_profile(response):
+        profile = _current_profile.get()
+
+        if profile is None:
+            return response
+
+        if profile.reason is not None:
+            response.headers[PROFILE_ID_HEADER] = get_request_id() or ''
+
+        request_summary = {'method': request.method, 'path': request.path, 'status': response.status_code}
+        request_id = get_request_id()
+
+        # Streamed responses are only done once the response is closed
+        response.call_on_close(lambda: _finish(config, profile, request_summary, request_id))
+
+        return response
+
+    @app.teardown_request
+    def reset_profile(error):
+        # Threads are reused for other requests
+        _current_profile.set(None)
+
+
+def _get_profile_reason(config, header_token):
+    if config['PROFILING_ENABLED']:
+        return 'config'
+
+    if config['PROFILING_TOKEN'] and header_token and hmac.compare_digest(header_token, config['PROFILING_TOKEN']):
+        return 'header'
+
+    if config['PROFILING_SAMPLE_RATE'] and random.random() < config['PROFILING_SAMPLE_RATE']:
+        return 'sampled'
+
+    return None
+
+
+def _finish(config, profile, request_summary, request_id):
+    """
+    Stops sampling a request's stacks, and dumps its profile if it was profiled or slow.
+    """
+    duration = time.perf_counter() - profile.started_at
+
+    if profile.reason is not None:
+        profile.stacks = _get_sampler(config['PROFILING_SAMPLE_INTERVAL']).remove(profile)
+
+    slow_request_ms = config['PROFILING_SLOW_REQUEST_MS']
+    is_slow = slow_request_ms and duration * 1000 >= slow_request_ms
+
+    if profile.reason is None and not is_slow:
+        return
+
+    dump = dict(profile.to_dict(duration), request_id=request_id, slow=bool(is_slow), **request_summary)
+
+    _write_dump(config['PROFILING_DUMP_DIR'], config['PROFILING_MAX_DUMPS'], dump)
+
+
+def _write_dump(directory, max_dumps, dump):
+    """
+    Writes a profile to the ring buffer, dropping the oldest profiles past max_dumps.
+    """
+    try:
+        # Request IDs may come from clients, keep them from escaping the directory
+        request_id = re.sub(r'[^\w-]', '', dump['request_id'] or '')[:64] or 'none'
+        file_name = f"{time.time_ns()}-{os.getpid()}-{request_id}.json"
+
+        with _dump_lock:
+            os.makedirs(directory, exist_ok=True)
+
+            with open(os.path.join(directory, file_name), 'w') as file:
+                json.dump(dump, file)
+
+            # Names start with the time they were written, so they sort oldest first
+            dumps = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+
+            for name in dumps[:max(len(dumps) - max_dumps, 0)]:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    # Another worker removed it first
+                    pass
+
+        logger.info(f"Dumped profile of {dump['method']} {dump['path']} ({dump['duration_ms']} ms) to {file_name}")
+    except OSError as e:
+        logger.error(f"Failed to dump request profile. Error: {e}")
+
+
+def _get_sampler(interval):
+    """
+    Returns the stack sampler of this process, started on first use.
+    """
+    global _sampler, _sampler_pid
+
+    with _sampler_lock:
+        if _sampler is None or _sampler_pid != os.getpid():
+            _sampler = StackSampler(interval)
+            _sampler_pid = os.getpid()
+
+        return _sampler
+
+
+def _fold_stack(frame):
+    """
+    Returns a stack as a single "file:function:line;..." string, outermost frame first.
+    """
+    entries = []
+
+    while frame is not None and len(entries) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+
+    return ';'.join(reversed(entries))
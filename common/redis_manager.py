@@ -1,31 +1,92 @@
+import atexit
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
 import redis
-from redis.exceptions import RedisError, ConnectionError
+from redis.exceptions import RedisError
 from flask import current_app as app
 
 from .app_logging import logger
+from .metrics import observe, count_cache_lookup, POOL_CONNECTIONS
 
 
-def create_redis_client():
+# One connection pool per process. redis-py pools detect forks on their own and
+# reset their connections in the child, so sharing the pool object is safe.
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+# Seconds between attempts to subscribe to cache invalidations, while Redis can't be reached
+SUBSCRIBE_RETRY_INTERVAL = 30
+
+
+class MeteredConnectionPool(redis.ConnectionPool):
+    """
+    A Redis connection pool that reports its open and checked out connections (see POOL_CONNECTIONS).
     """
-    Create Redis client instance.
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super().get_connection(command_name, *keys, **options)
+        self._report()
+
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        self._report()
+
+    def _report(self):
+        POOL_CONNECTIONS.labels('redis', 'open').set(self._created_connections)
+        POOL_CONNECTIONS.labels('redis', 'checked_out').set(len(self._in_use_connections))
+
+
+def init_redis_pool(config):
+    """
+    Create the process-wide Redis connection pool.
+
+    Should be called once at app startup. Calling it again replaces the pool.
+
+    Args:
+        config (dict): The app config, containing REDIS_HOST, REDIS_PORT and the pool settings.
 
     Returns:
-        redis.Redis or None: Redis client instance if connection is successful, otherwise None.
+        redis.ConnectionPool: The created connection pool.
     """
-    try:
-        host = app.config['REDIS_HOST']
-        port = app.config['REDIS_PORT']
-        redis_client = redis.Redis(host=host, port=port)
+    global _connection_pool
 
-        # Check if client can connect
-        redis_client.ping()
+    with _connection_pool_lock:
+        if _connection_pool is not None:
+            _connection_pool.disconnect()
 
-        return redis_client
-    except (ConnectionError, ConnectionRefusedError) as e:
-        logger.error(f"Failed to connect to Redis server. Error: {e}")
+        _connection_pool = MeteredConnectionPool(
+            host=config['REDIS_HOST'],
+            port=config['REDIS_PORT'],
+            max_connections=config.get('REDIS_MAX_CONNECTIONS'),
+            socket_timeout=config.get('REDIS_SOCKET_TIMEOUT'),
+            socket_connect_timeout=config.get('REDIS_SOCKET_CONNECT_TIMEOUT'),
+            health_check_interval=config.get('REDIS_HEALTH_CHECK_INTERVAL', 0))
+        logger.info(
+            f"Created Redis connection pool for {config['REDIS_HOST']}:{config['REDIS_PORT']}")
 
-        return None
+        return _connection_pool
+
+
+def get_redis_client():
+    """
+    Get a Redis client backed by the process-wide connection pool.
+
+    Creating the client is cheap and doesn't talk to the server; connections are
+    taken from the pool per command and health checked by the pool itself.
+    If the pool wasn't initialized at startup, it is created from the current app config.
+
+    Returns:
+        redis.Redis or None: Redis client instance, or None if the pool could not be created.
+    """
+    try:
+        pool = _connection_pool or init_redis_pool(app.config)
+
+        return redis.Redis(connection_pool=pool)
     except RedisError as e:
         logger.error(f"Failed to create Redis client. Error: {e}")
 
@@ -44,7 +105,8 @@ def get_from_cache(client, key):
         dict or None: Decoded JSON data if key exists in cache, otherwise None.
     """
     try:
-        cached_data = client.get(key)
+        with observe('redis', 'get'):
+            cached_data = client.get(key)
 
         if cached_data:
             return json.loads(cached_data)
@@ -72,21 +134,496 @@ def set_in_cache(client, key, data, ex):
     """
     try:
         serialized_data = json.dumps(data)
-        client.set(key, serialized_data, ex=ex)
+
+        with observe('redis', 'set'):
+            client.set(key, serialized_data, ex=ex)
     except RedisError as e:
         logger.error(f"Failed to set data in cache. Error: {e}")
     except json.JSONDecodeError as e:
         logger.error(f"Failed to encode data to cache. Error: {e}")
 
 
-def close_redis_client(client):
+def get_many_from_cache(client, keys, loads=json.loads):
+    """
+    Retrieve several keys from Redis cache in a single round trip.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        keys (list): Keys to retrieve data from Redis cache.
+        loads (callable, optional): Decodes the cached data. Defaults to JSON.
+
+    Returns:
+        list: The decoded data of each key, in order, with None for keys that are not in the cache.
+              Every item is None if the cache could not be read.
+    """
+    try:
+        with observe('redis', 'mget'):
+            cached_data = client.mget(keys) if keys else []
+
+        return [loads(data) if data else None for data in cached_data]
+    except RedisError as e:
+        logger.error(f"Failed to get data from cache. Error: {e}")
+
+        return [None] * len(keys)
+    except (TypeError, ValueError) as e:
+        logger.error(f"Failed to decode cached data. Error: {e}")
+
+        return [None] * len(keys)
+
+
+def set_many_in_cache(client, mapping, ex, dumps=json.dumps):
+    """
+    Set several keys in Redis cache in a single round trip.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        mapping (dict): Data to set in Redis cache, by key.
+        ex (int): Expiration time in seconds.
+        dumps (callable, optional): Encodes the data. Defaults to JSON.
+    """
+    try:
+        with client.pipeline(transaction=False) as pipe:
+            for key, data in mapping.items():
+                pipe.set(key, dumps(data), ex=ex)
+
+            with observe('redis', 'mset'):
+                pipe.execute()
+    except RedisError as e:
+        logger.error(f"Failed to set data in cache. Error: {e}")
+    except (TypeError, ValueError) as e:
+        logger.error(f"Failed to encode data to cache. Error: {e}")
+
+
+def get_hash_from_cache(client, key):
+    """
+    Retrieve all fields of a hash from Redis cache.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        key (str): Key of the hash in Redis cache.
+
+    Returns:
+        dict or None: The hash fields (names decoded, values as raw bytes) if the key exists, otherwise None.
+    """
+    try:
+        with observe('redis', 'hgetall'):
+            cached_data = client.hgetall(key)
+
+        if cached_data:
+            return {field.decode(): value for field, value in cached_data.items()}
+        else:
+            return None
+    except RedisError as e:
+        logger.error(f"Failed to get hash from cache. Error: {e}")
+
+        return None
+
+
+def set_hash_in_cache(client, key, mapping, ex):
+    """
+    Replace a hash in Redis cache atomically, in a single round trip.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        key (str): Key of the hash in Redis cache.
+        mapping (dict): Fields to store. Values must be bytes, str, int or float.
+        ex (int): Expiration time in seconds.
+    """
+    try:
+        with client.pipeline(transaction=True) as pipe:
+            # Drop the previous value first, which may be of another type or have other fields
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, ex)
+
+            with observe('redis', 'hset'):
+                pipe.execute()
+    except RedisError as e:
+        logger.error(f"Failed to set hash in cache. Error: {e}")
+
+
+# Takes the lock only if nobody holds it, using a new fencing token as the lock value.
+# Tokens come from a counter that only grows, so a later holder always has a larger token.
+_ACQUIRE_LOCK_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return false
+end
+local token = redis.call('incr', KEYS[2])
+redis.call('set', KEYS[1], token, 'NX', 'PX', ARGV[1])
+return token
+"""
+
+# Deletes the lock only if it is still held with the caller's fencing token.
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_lock(client, name, ttl_ms):
+    """
+    Try to acquire a distributed lease lock (SET NX PX) without waiting.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        name (str): The lock key.
+        ttl_ms (int): Lease duration in milliseconds. The lock is released automatically after it.
+
+    Returns:
+        int or None: The fencing token of the acquired lock, or None if it is held by someone else.
+
+    Raises:
+        RedisError: If Redis could not be reached. Callers can't wait for a lease that nobody can hold.
+    """
+    acquire = client.register_script(_ACQUIRE_LOCK_SCRIPT)
+
+    with observe('redis', 'acquire_lock'):
+        token = acquire(keys=[name, f"{name}:fence"], args=[ttl_ms])
+
+    return int(token) if token is not None else None
+
+
+# Replaces a hash only if the lock KEYS[2] is still held with the fencing token ARGV[1].
+# ARGV[2] is the expiration time in seconds, the remaining arguments are the hash's fields and values.
+_SET_HASH_IF_LOCK_HELD_SCRIPT = """
+if redis.call('get', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+redis.call('del', KEYS[1])
+redis.call('hset', KEYS[1], unpack(ARGV, 3))
+redis.call('expire', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def set_hash_if_lock_held(client, key, mapping, ex, lock_name, token):
+    """
+    Replace a hash in Redis cache, only if a lease lock is still held with the given fencing token.
+
+    The check and the write run in a single script, so a holder whose lease expired can't overwrite
+    the entry written by the next holder.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        key (str): Key of the hash in Redis cache.
+        mapping (dict): Fields to store. Values must be bytes, str, int or float.
+        ex (int): Expiration time in seconds.
+        lock_name (str): The lock key.
+        token (int): The fencing token returned by acquire_lock.
+
+    Returns:
+        bool: True if the hash was written, False if the lease was lost or Redis could not be reached.
+    """
+    try:
+        set_hash = client.register_script(_SET_HASH_IF_LOCK_HELD_SCRIPT)
+        fields = [item for field_value in mapping.items() for item in field_value]
+
+        with observe('redis', 'hset'):
+            return bool(set_hash(keys=[key, lock_name], args=[token, ex] + fields))
+    except RedisError as e:
+        logger.error(f"Failed to set hash in cache. Error: {e}")
+
+        return False
+
+
+def release_lock(client, name, token):
     """
-    Close Redis client connection.
+    Release a lease lock, unless it already expired and was taken by someone else.
 
     Args:
         client (redis.Redis): Redis client instance.
+        name (str): The lock key.
+        token (int): The fencing token returned by acquire_lock.
+
+    Returns:
+        bool: True if the lock was released, False otherwise.
     """
     try:
-        client.close()
+        release = client.register_script(_RELEASE_LOCK_SCRIPT)
+
+        with observe('redis', 'release_lock'):
+            return bool(release(keys=[name], args=[token]))
+    except RedisError as e:
+        logger.error(f"Failed to release lock {name}. Error: {e}")
+
+        return False
+
+
+# Token bucket: refills at ARGV[1] tokens per second, up to ARGV[2], and takes ARGV[3] tokens if it has them.
+# Time comes from the Redis server, so workers with skewed clocks share a consistent bucket.
+# Returns whether the tokens were taken, and the seconds until they would be (as a string, Lua numbers are
+# truncated to integers in replies).
+_TAKE_TOKENS_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local server_time = redis.call('time')
+local now = tonumber(server_time[1]) + tonumber(server_time[2]) / 1000000
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('hset', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('pexpire', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+
+def take_rate_limit_tokens(client, key, rate, burst, cost=1):
+    """
+    Take tokens from a token bucket rate limit, atomically and in a single round trip.
+
+    The bucket starts full, and expires once it would be full again, so idle clients cost nothing.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        key (str): The bucket key, e.g. per route and client.
+        rate (float): Tokens added per second - the sustained rate allowed.
+        burst (int): Bucket capacity - the requests allowed at once after a quiet period.
+        cost (int, optional): Tokens taken. Defaults to 1.
+
+    Returns:
+        tuple: Whether the tokens were taken, and the seconds to wait before they would be (0 if taken).
+               Returns (True, 0) if Redis could not be reached: a limiter outage doesn't take the service down.
+    """
+    try:
+        take = client.register_script(_TAKE_TOKENS_SCRIPT)
+
+        with observe('redis', 'rate_limit'):
+            allowed, retry_after = take(keys=[key], args=[rate, burst, cost])
+
+        return bool(allowed), float(retry_after)
+    except RedisError as e:
+        logger.error(f"Failed to check rate limit {key}. Error: {e}")
+
+        return True, 0
+
+
+class LocalCache:
+    """
+    Bounded, thread-safe in-process LRU cache with per-entry expiry.
+
+    Args:
+        max_size (int): Maximum number of entries. The least recently used entry is evicted first.
+        ttl (float): Default time to live of an entry, in seconds.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value of a key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+
+                return None
+
+            self._entries.move_to_end(key)
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value for `ttl` seconds (the cache's default TTL if not given).
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TwoTierCache:
+    """
+    In-process LocalCache (L1) in front of Redis (L2).
+
+    Reads are answered from L1 when possible, and fall back to Redis through a loader function,
+    since each user decides how its values are stored in Redis. Writers call invalidate() after
+    updating Redis, which drops the key from L1 in every worker over Redis pub/sub.
+
+    Args:
+        name (str): The cache name, used for the invalidation channel.
+        max_size (int): Maximum number of L1 entries.
+        ttl (float): Time to live of L1 entries, in seconds. Bounds staleness if an invalidation is missed.
+    """
+
+    def __init__(self, name, max_size, ttl):
+        self.name = name
+        self.channel = f"cache-invalidation:{name}"
+        self.local = LocalCache(max_size, ttl)
+        self._counters = {'l1_hits': 0, 'l1_misses': 0, 'l2_hits': 0, 'l2_misses': 0}
+        self._counters_lock = threading.Lock()
+        self._subscriber = None
+        self._subscriber_pid = None
+        self._subscriber_lock = threading.Lock()
+        self._subscribe_failed_at = None
+
+    def get(self, key, load):
+        """
+        Get a value from L1, or from Redis through `load` on an L1 miss.
+
+        Args:
+            key (str): The cache key.
+            load (callable): Called with the key on an L1 miss. Returns the value from Redis, or None.
+
+        Returns:
+            The cached value, or None if neither tier has it.
+        """
+        self._ensure_subscribed()
+        value = self.local.get(key)
+
+        if value is not None:
+            self._count('l1_hits')
+
+            return value
+
+        self._count('l1_misses')
+        value = load(key)
+
+        if value is None:
+            self._count('l2_misses')
+
+            return None
+
+        self._count('l2_hits')
+        self.local.set(key, value)
+
+        return value
+
+    def invalidate(self, key):
+        """
+        Drop a key from L1 in this and every other worker subscribed to the cache.
+
+        Args:
+            key (str): The cache key.
+        """
+        self.local.delete(key)
+
+        try:
+            get_redis_client().publish(self.channel, key)
+        except (RedisError, AttributeError) as e:
+            logger.error(f"Failed to publish invalidation of {key}. Error: {e}")
+
+    def stats(self):
+        """
+        Returns hit and miss counters per tier, and the current number of L1 entries.
+        """
+        with self._counters_lock:
+            counters = dict(self._counters)
+
+        return {
+            'l1': {'hits': counters['l1_hits'], 'misses': counters['l1_misses'], 'size': len(self.local)},
+            'l2': {'hits': counters['l2_hits'], 'misses': counters['l2_misses']}
+        }
+
+    def _count(self, counter):
+        with self._counters_lock:
+            self._counters[counter] += 1
+
+        tier, result = counter.split('_')
+        count_cache_lookup(f"{self.name}:{tier}", result == 'hits')
+
+    def _ensure_subscribed(self):
+        """
+        Starts the invalidation listener thread, once per process.
+
+        Only one request tries at a time, the others go on without waiting for it. After a failure, subscribing
+        is retried at most every SUBSCRIBE_RETRY_INTERVAL seconds, and requests are served from L1 and Redis
+        meanwhile, with L1 staleness bounded by its TTL.
+        """
+        if self._subscriber_pid == os.getpid():
+            return
+
+        failed_at = self._subscribe_failed_at
+
+        if failed_at is not None and time.monotonic() - failed_at < SUBSCRIBE_RETRY_INTERVAL:
+            return
+
+        if not self._subscriber_lock.acquire(blocking=False):
+            return
+
+        try:
+            if self._subscriber_pid == os.getpid():
+                return
+
+            redis_client = get_redis_client()
+
+            if redis_client is None:
+                self._subscribe_failed_at = time.monotonic()
+
+                return
+
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.channel: self._on_invalidation})
+                self._subscriber = pubsub.run_in_thread(
+                    sleep_time=1, daemon=True, exception_handler=self._on_subscriber_error)
+                self._subscriber_pid = os.getpid()
+                self._subscribe_failed_at = None
+            except RedisError as e:
+                self._subscribe_failed_at = time.monotonic()
+                logger.error(f"Failed to subscribe to {self.channel}, retrying in {SUBSCRIBE_RETRY_INTERVAL}s. "
+                             f"Error: {e}")
+        finally:
+            self._subscriber_lock.release()
+
+    def _on_invalidation(self, message):
+        self.local.delete(message['data'].decode())
+
+    def _on_subscriber_error(self, error, pubsub, thread):
+        # Invalidations may have been missed while disconnected, so don't trust L1 anymore.
+        # The pubsub reconnects and resubscribes on its next read.
+        logger.error(f"Lost invalidation subscription to {self.channel}. Error: {error}")
+        self.local.clear()
+        time.sleep(1)
+
+
+def close_redis_pool():
+    """
+    Disconnect every connection in the process-wide Redis connection pool.
+    """
+    try:
+        if _connection_pool is not None:
+            _connection_pool.disconnect()
     except Exception as e:
-        logger.error(f"Failed to close Redis client connection. Error: {e}")
+        logger.error(f"Failed to close Redis connection pool. Error: {e}")
+
+
+atexit.register(close_redis_pool)
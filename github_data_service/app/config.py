@@ -1,7 +1,91 @@
-GITHUB_API_BASE_URL = 'https://api.github.com'
+import os
+
+# Overridden to point the service at a stand-in, e.g. the fake GitHub server of the benchmarks
+GITHUB_API_BASE_URL = os.environ.get('GITHUB_API_BASE_URL', 'https://api.github.com').rstrip('/')
 GITHUB_API_SEARCH_REPOS_URL = GITHUB_API_BASE_URL + '/search/repositories'
+GITHUB_SEARCH_MAX_RESULTS = 1000  # GitHub search API never returns more results than this
+GITHUB_MAX_CONCURRENT_PAGES = 5  # search result pages fetched in parallel
+GITHUB_PAGE_CACHE_EX = 60*60*24*7  # pages are kept with their ETag for conditional requests
+GITHUB_SEARCH_PER_PAGE = 100  # the most GitHub search returns per page
+RANKING_LIMIT_BUCKET_SIZE = 100  # ranking limits are rounded up to a multiple of this, to share cache entries
+
+# GitHub API client - requests are spread over a pool of tokens (comma separated)
+GITHUB_TOKENS = [token.strip() for token in os.environ.get('GITHUB_TOKENS', '').split(',') if token.strip()]
+GITHUB_REQUEST_TIMEOUT = 10  # seconds
+GITHUB_MAX_RETRIES = 3
+GITHUB_BACKOFF_BASE = 1  # seconds - doubles on every retry, with jitter
+GITHUB_BACKOFF_MAX = 30  # seconds
+GITHUB_MAX_RATE_LIMIT_WAIT = 60  # seconds to wait for a rate limit reset before giving up
+
+# MongoDB - shared repositories store, read by the favorites service
+DB_USERNAME = os.environ.get('MONGO_USERNAME')
+DB_PASSWORD = os.environ.get('MONGO_PASSWORD')
+DB_HOST = 'mongodb'
+DB_PORT = '27017'
+DB_URI = f'mongodb://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/'
+DB_MAX_POOL_SIZE = int(os.environ.get('DB_MAX_POOL_SIZE', 10))
+DB_CONNECT_TIMEOUT_MS = int(os.environ.get('DB_CONNECT_TIMEOUT_MS', 5 * 1000))
+DB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('DB_SERVER_SELECTION_TIMEOUT_MS', 5 * 1000))
+DB_SOCKET_TIMEOUT_MS = int(os.environ.get('DB_SOCKET_TIMEOUT_MS', 10 * 1000))
+DB_NAME = 'ZEST_DB'
+REPOSITORIES_COLLECTION = 'repositories'
+REPOSITORY_STORE_ENABLED = os.environ.get('REPOSITORY_STORE_ENABLED', 'true').lower() == 'true'
 
 # Redis
-REDIS_HOST = 'redis'
-REDIS_PORT = 6379
-CACHE_EX = 60*60*24
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_SOCKET_TIMEOUT = 2  # seconds
+REDIS_SOCKET_CONNECT_TIMEOUT = 2  # seconds
+REDIS_HEALTH_CHECK_INTERVAL = 30  # seconds - idle connections are pinged before reuse
+
+# Top repositories cache - entries are served stale-while-revalidate
+CACHE_EX = 60*60*24  # hard TTL - Redis drops the entry
+CACHE_SOFT_TTL = 60*60  # entries older than this are refreshed in the background
+CACHE_PREWARM_ENABLED = os.environ.get('CACHE_PREWARM_ENABLED', 'true').lower() == 'true'
+CACHE_PREWARM_INTERVAL = 60*30  # seconds between pre-warm runs
+# Popular rankings, kept fresh by the pre-warm job. Other rankings are fetched on demand, then cached.
+# Missing criteria default to the top 100 repositories by stars, in descending order, with no filter.
+PRECOMPUTED_RANKINGS = [
+    {},
+    {'sort_by': 'forks'},
+    {'sort_by': 'updated'},
+    {'limit': 1000},
+    {'language': 'python'},
+    {'language': 'javascript'},
+    {'language': 'typescript'},
+    {'language': 'java'},
+    {'language': 'go'},
+    {'language': 'rust'},
+]
+L1_CACHE_MAX_SIZE = 64  # in-process entries kept in front of Redis
+L1_CACHE_TTL = 60  # seconds - bounds staleness if a pub/sub invalidation is missed
+PROJECTED_PAYLOADS_MAX_SIZE = 64  # in-process payloads restricted to the fields= a client asked for
+SNAPSHOT_EX = 60*60*24*7  # ranking snapshots and change logs, kept longer than the payloads
+CHANGE_LOG_MAX_SIZE = 100  # versions of changes kept per ranking
+REPOSITORY_CACHE_EX = 60*60*24  # single repositories, served by GET /github/repositories
+REPOSITORY_LOOKUP_MAX_IDS = 1000  # IDs allowed in a single GET /github/repositories
+REPOSITORY_LOOKUP_MAX_FETCHES = 50  # uncached ones fetched from GitHub API per call, the rest are returned as missing
+GZIP_COMPRESS_LEVEL = 6  # cached response bodies are compressed once, when they are fetched
+
+# Cache refresh lease - only one worker across the cluster fetches from GitHub at a time
+REFRESH_LOCK_TTL_MS = 60 * 1000  # lease duration, longer than a full GitHub fetch
+REFRESH_LOCK_WAIT = 30  # seconds a caller waits for another worker's fetch
+REFRESH_LOCK_POLL_INTERVAL = 0.2  # seconds between cache checks while waiting
+
+# Admission control - requests past the concurrency cap get a 503. Responses are cached, so there are no rate limits.
+# Concurrency cap per worker, 0 disables it. Defaults to what a worker runs at once (see gunicorn_conf.py):
+# WEB_THREADS with gthread workers, a quarter of WEB_WORKER_CONNECTIONS with gevent ones
+ADMISSION_MAX_CONCURRENT_REQUESTS = int(os.environ.get('ADMISSION_MAX_CONCURRENT_REQUESTS', (
+    int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000)) // 4 if os.environ.get('WEB_WORKER_CLASS') == 'gevent'
+    else int(os.environ.get('WEB_THREADS', 8)))))
+
+# Request profiling - spans of every request are kept, in case it turns out slow.
+# Profiled requests (all, a sample, or those with a matching X-Profile header) also get a stack profile.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))  # fraction of requests profiled
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # X-Profile header value of trusted callers
+PROFILING_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILING_SLOW_REQUEST_MS = int(os.environ.get('PROFILING_SLOW_REQUEST_MS', 1000))  # 0 disables slow request dumps
+PROFILING_DUMP_DIR = './logs/profiles'
+PROFILING_MAX_DUMPS = 200  # oldest dumps are deleted past this
@@ -1,32 +1,230 @@
-from flask import jsonify, make_response, abort, Blueprint
-from utils.github_api import get_top_100_repos_by_stars, create_session
+import re
+from flask import request, jsonify, make_response, abort, Blueprint, current_app as app
+from utils.github_api import get_top_repos_payload, get_top_repos_cache, get_github_client, get_repositories_by_ids, \
+    get_top_repos_changes, project_payload, DEFAULT_RANKING
+from utils.repository_record import REPOSITORY_FIELDS
+from utils.github_client import RateLimitExceeded
 from utils.app_logging import logger
 
 github_routes = Blueprint('github_routes', __name__)
 
+# Content encodings the cached payload is stored in, by order of preference
+PREFERRED_ENCODINGS = ('br', 'gzip')
+
+SORT_OPTIONS = ('stars', 'forks', 'updated')
+ORDER_OPTIONS = ('asc', 'desc')
+# GitHub language and topic names, e.g. "c++", "c#" or "machine-learning"
+SEARCH_FILTER_PATTERN = re.compile(r'^[\w.+#-]{1,50}$')
+
 
 @github_routes.route('/top-starred-repositories')
 def top_starred_repositories():
     """
-    Retrieves the top 100 repositories by stars from the database and returns them as a JSON response.
+    Retrieves the top repositories and returns them as a JSON response. By default the top 100 by stars.
+
+    The ranking is chosen with the sort, order, language, topic and limit query parameters, and the
+    fields query parameter (comma separated) restricts the repositories to some of their fields.
+    The response body is sent exactly as it is cached, compressed with the best encoding the client
+    accepts, with an ETag per encoding. Requests with a matching If-None-Match header get an empty 304 response.
+    The X-Ranking-Version header holds the ranking's version, to poll for its changes (see ranking_changes).
 
     Returns:
-        A Flask response object containing a JSON representation of the top 100 repositories by stars.
+        A Flask response object containing a JSON representation of the top repositories.
+        A JSON response containing an error message and a 400 status code if a query parameter is invalid.
+        If GitHub API rate limits are exhausted and nothing is cached, returns a 503 error with Retry-After.
 
     Raises:
         HTTPException: If there is an internal server error while retrieving the repositories.
     """
 
     try:
-        with create_session() as session:
-            repositories = get_top_100_repos_by_stars(session)
+        ranking = _parse_ranking()
+        fields = _parse_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        full_payload = get_top_repos_payload(get_github_client(), ranking)
+        payload = project_payload(full_payload, fields, ranking.limit)
 
-        response = make_response(jsonify(repositories))
-        response.status_code = 200
+        encoding = _choose_encoding(payload)
+        # Each encoding is a different representation, with its own strong ETag
+        etag = payload['etag'] if encoding == 'identity' else f"{payload['etag']}-{encoding}"
+
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(payload[encoding])
+            response.status_code = 200
+            response.mimetype = 'application/json'
+
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+
+        if 'version' in full_payload:
+            response.headers['X-Ranking-Version'] = str(full_payload['version'])
 
         return response
+    except RateLimitExceeded as e:
+        logger.error(f"Failed to retrieve top repos. Error: {e}")
+        response = jsonify({'error': 'GitHub API rate limit exceeded, try again later'})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+
+        return response, 503
     except Exception as e:
         logger.error(
-            f"Failed to retrieve top 100 starred repos by stars. Error: {e}")
+            f"Failed to retrieve top repos. Error: {e}")
 
         abort(500, description="Internal server error")
+
+
+@github_routes.route('/top-starred-repositories/changes')
+def ranking_changes():
+    """
+    Retrieves the changes of a ranking since a version, so clients can poll for deltas instead of
+    downloading the full ranking again. The ranking is chosen like in top_starred_repositories.
+
+    Returns:
+        A JSON response containing the ranking's current version and the changes of every later version, oldest first.
+        A JSON response containing an error message and a 400 status code if a query parameter is invalid.
+        A JSON response containing an error message and a 410 status code if the changes since that version
+        are no longer kept, and the full ranking has to be downloaded again.
+        A JSON response containing an error message and a 503 status code if the changes could not be retrieved.
+    """
+    since = request.args.get('since', '')
+
+    try:
+        ranking = _parse_ranking()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not since.isdigit():
+        return jsonify({'error': 'Missing or invalid since, should be a ranking version'}), 400
+
+    result = get_top_repos_changes(ranking, int(since))
+
+    if result is None:
+        return jsonify({'error': 'Changes are unavailable, try again later'}), 503
+
+    version, changes = result
+
+    if changes is None:
+        return jsonify({'error': 'Changes since this version are no longer available, '
+                                 'download the full ranking again', 'version': version}), 410
+
+    return jsonify({'version': version, 'changes': changes}), 200
+
+
+def _parse_ranking():
+    """
+    Reads the requested ranking from the query parameters. Missing parameters default to DEFAULT_RANKING.
+
+    Raises:
+        ValueError: If a query parameter is invalid.
+    """
+    sort_by = request.args.get('sort', DEFAULT_RANKING.sort_by)
+    order = request.args.get('order', DEFAULT_RANKING.order)
+    language = request.args.get('language', '').lower() or None
+    topic = request.args.get('topic', '').lower() or None
+    limit = request.args.get('limit', str(DEFAULT_RANKING.limit))
+    max_limit = app.config['GITHUB_SEARCH_MAX_RESULTS']
+
+    if sort_by not in SORT_OPTIONS:
+        raise ValueError(f"Invalid sort, should be one of {', '.join(SORT_OPTIONS)}")
+
+    if order not in ORDER_OPTIONS:
+        raise ValueError(f"Invalid order, should be one of {', '.join(ORDER_OPTIONS)}")
+
+    for name, value in (('language', language), ('topic', topic)):
+        if value is not None and not SEARCH_FILTER_PATTERN.match(value):
+            raise ValueError(f"Invalid {name}")
+
+    if not limit.isdigit() or not 1 <= int(limit) <= max_limit:
+        raise ValueError(f"Invalid limit, should be between 1 and {max_limit}")
+
+    return DEFAULT_RANKING._replace(sort_by=sort_by, order=order, language=language, topic=topic, limit=int(limit))
+
+
+def _parse_fields():
+    """
+    Reads the requested repository fields from the query parameters. Defaults to all of them.
+
+    Returns:
+        tuple: The fields, in the order of REPOSITORY_FIELDS.
+
+    Raises:
+        ValueError: If a field is unknown.
+    """
+    fields = request.args.get('fields')
+
+    if not fields:
+        return REPOSITORY_FIELDS
+
+    requested = set(fields.split(','))
+    unknown = requested.difference(REPOSITORY_FIELDS)
+
+    if unknown:
+        raise ValueError(f"Invalid fields: {', '.join(sorted(unknown))}")
+
+    return tuple(field for field in REPOSITORY_FIELDS if field in requested)
+
+
+@github_routes.route('/repositories')
+def repositories_by_ids():
+    """
+    Retrieves several repositories by their GitHub IDs, in a single call. Meant for other services.
+
+    Repositories are answered from the cache, only the ones that are not cached are fetched from GitHub API,
+    up to REPOSITORY_LOOKUP_MAX_FETCHES of them. The others are returned as missing.
+
+    Returns:
+        A JSON response containing the repositories that were found, by their ID, and the IDs that were not found.
+        A JSON response containing an error message and a 400 status code if the IDs are missing or invalid.
+    """
+    ids = [repository_id for repository_id in request.args.get('ids', '').split(',') if repository_id]
+    max_ids = app.config['REPOSITORY_LOOKUP_MAX_IDS']
+
+    if not ids or not all(repository_id.isdigit() for repository_id in ids):
+        return jsonify({'error': 'Missing or invalid ids, should be comma separated repository IDs'}), 400
+
+    if len(ids) > max_ids:
+        return jsonify({'error': f'Too many ids, at most {max_ids} are allowed'}), 400
+
+    try:
+        repository_ids = list(dict.fromkeys(int(repository_id) for repository_id in ids))
+        repositories = get_repositories_by_ids(get_github_client(), repository_ids)
+
+        return jsonify({
+            'repositories': {str(repository_id): repository.to_dict()
+                             for repository_id, repository in repositories.items()},
+            'missing': [str(repository_id) for repository_id in repository_ids if repository_id not in repositories]
+        }), 200
+    except Exception as e:
+        logger.error(f"Failed to retrieve repositories by IDs. Error: {e}")
+
+        abort(500, description="Internal server error")
+
+
+@github_routes.route('/cache-stats')
+def cache_stats():
+    """
+    Returns the hit and miss counters of the top repositories cache, per tier, for this worker.
+
+    Returns:
+        A JSON response containing the counters of the in-process (l1) and Redis (l2) tiers.
+    """
+    return jsonify(get_top_repos_cache().stats()), 200
+
+
+def _choose_encoding(payload):
+    """
+    Returns the best content encoding that both the client accepts and the payload is stored in.
+    """
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding in payload and request.accept_encodings[encoding]:
+            return encoding
+
+    return 'identity'
@@ -1,13 +1,31 @@
 import os
 from flask import Flask
 from routes import github_routes
+from utils.redis_manager import init_redis_pool
+from utils.github_api import prewarm_top_repos_cache
+from utils.cache_refresher import start_periodic_job
+from utils.app_logging import init_request_logging
+from utils.metrics import init_metrics
+from utils.profiling import init_profiling
+from utils.admission_control import init_admission_control
 
 app = Flask(__name__)
 app.config.from_pyfile('config.py')
 app.register_blueprint(github_routes, url_prefix='/github')
+init_request_logging(app)
+init_metrics(app)
+init_profiling(app)
+init_admission_control(app)
+init_redis_pool(app.config)
+
+if app.config['CACHE_PREWARM_ENABLED']:
+    start_periodic_job(app, app.config['CACHE_PREWARM_INTERVAL'],
+                       prewarm_top_repos_cache, 'top-repos-prewarm')
 
 
 if __name__ == '__main__':
     host = os.environ.get('HOST', '0.0.0.0')
     port = os.environ.get('PORT', 8080)
-    app.run(host=host, port=port, debug=True)
+    # Development server only. In production the app is served by gunicorn, see gunicorn_conf.py
+    debug = os.environ.get('FLASK_DEBUG', 'true').lower() == 'true'
+    app.run(host=host, port=port, debug=debug)
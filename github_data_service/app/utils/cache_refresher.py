@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.app_logging import logger
+
+# Every background refresh runs on this single worker, so a stale cache entry
+# is never refreshed by more than one thread of the process at a time.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-refresh')
+_pending_keys = set()
+_pending_keys_lock = threading.Lock()
+
+
+def schedule_refresh(app, key, refresh):
+    """
+    Queue a background refresh of a cache entry, unless one is already pending for it.
+
+    Args:
+        app (flask.Flask): The app whose context the refresh runs in.
+        key (str): The cache key being refreshed. Used to drop duplicate refreshes.
+        refresh (callable): A function without arguments that refreshes the entry.
+
+    Returns:
+        bool: True if the refresh was queued, False if one was already pending.
+    """
+    with _pending_keys_lock:
+        if key in _pending_keys:
+            return False
+
+        _pending_keys.add(key)
+
+    def run():
+        try:
+            with app.app_context():
+                refresh()
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed. Error: {e}")
+        finally:
+            with _pending_keys_lock:
+                _pending_keys.discard(key)
+
+    _executor.submit(run)
+    logger.info(f"Scheduled background refresh of {key}")
+
+    return True
+
+
+def start_periodic_job(app, interval, job, name):
+    """
+    Run a job in a daemon thread right away and then every `interval` seconds.
+
+    Args:
+        app (flask.Flask): The app whose context the job runs in.
+        interval (int): Seconds to wait between runs.
+        job (callable): A function without arguments to run.
+        name (str): The name of the job thread, used in logs.
+
+    Returns:
+        threading.Event: Setting this event stops the job.
+    """
+    stop_event = threading.Event()
+
+    def loop():
+        while not stop_event.is_set():
+            try:
+                with app.app_context():
+                    job()
+            except Exception as e:
+                logger.error(f"Periodic job {name} failed. Error: {e}")
+
+            stop_event.wait(interval)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    logger.info(f"Started periodic job {name}. Interval: {interval} seconds")
+
+    return stop_event
@@ -1,143 +1,215 @@
+import contextvars
+import functools
+import gzip
+import hashlib
+import math
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+import orjson
 import requests
 from flask import current_app as app
+from redis.exceptions import RedisError
 
 from utils.app_logging import logger
-from utils.redis_manager import create_redis_client, get_from_cache, set_in_cache, close_redis_client
+from utils.redis_manager import get_redis_client, get_hash_from_cache, set_hash_in_cache, get_many_from_cache, set_many_in_cache, \
+    set_hash_if_lock_held, acquire_lock, release_lock, TwoTierCache, LocalCache
+from utils.cache_refresher import schedule_refresh
+from utils.single_flight import SingleFlight
+from utils.github_client import GitHubClient, GitHubAPIError
+from utils.repositories_db import save_repositories
+from utils.ranking_snapshot import update_snapshot, get_changes
+from utils.repository_record import RepositoryRecord, REPOSITORY_FIELDS, pack_record, unpack_record, pack_records, \
+    unpack_records
 
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, responses are then compressed with gzip only
+    brotli = None
 
-    
-def _get_repositories_from_github(session, sort_by, order, per_page):
+# A ranking of GitHub repositories: the search criteria, and how many of the top repositories it holds.
+# language and topic are optional filters (None for any).
+Ranking = namedtuple('Ranking', ['sort_by', 'order', 'language', 'topic', 'limit'])
+DEFAULT_RANKING = Ranking('stars', 'desc', None, None, 100)
+
+# Error responses of GitHub API are only logged up to this many characters
+LOGGED_RESPONSE_MAX_LENGTH = 200
+
+# Coalesces concurrent refreshes of the same cache entry within this process
+_refreshes = SingleFlight()
+
+_github_client = None
+_github_client_lock = threading.Lock()
+
+# In-process copy of the cached payloads, created on first use from the app config
+_top_repos_cache = None
+
+# Payloads restricted to some fields, by the ETag of their full payload and the fields
+_projected_payloads = None
+_projected_payloads_lock = threading.Lock()
+
+
+def _get_repositories_from_github(client, ranking, per_page):
+    """
+    Retrieve the top GitHub repositories matching the ranking's criteria, as many as the ranking's
+    limit bucket holds (see _get_bucket_limit).
+
+    The first page is fetched alone to learn the page count, the remaining pages are then
+    fetched concurrently. Every page is requested with the ETag of its previous response,
+    and unchanged pages (304, which don't count against the rate limit) are read from Redis.
+    Partial results are never returned: if any page fails, the whole fetch fails, so
+    a truncated list is never cached.
+
+    Args:
+        client (GitHubClient): The client used to make requests to GitHub API.
+        ranking (Ranking): The search criteria and the number of repositories to retrieve.
+            Valid sort_by values are 'stars', 'forks', and 'updated', valid orders are 'asc' and 'desc'.
+            GitHub search returns at most GITHUB_SEARCH_MAX_RESULTS results.
+        per_page (int): The number of repositories to retrieve per page. Every ranking uses the same
+            page size, so rankings that differ only by their limit share the same cached pages.
+
+    Returns:
+        list: Up to `_get_bucket_limit(ranking.limit)` repositories, as RepositoryRecords.
+
+    Raises:
+        GitHubAPIError: If any page of results could not be retrieved.
+    """
+    top_n = _get_bucket_limit(ranking.limit)
+    fetch_page = functools.partial(
+        _fetch_repositories_page, client, get_redis_client(),
+        app.config['GITHUB_API_SEARCH_REPOS_URL'],
+        {'q': _get_search_query(ranking), 'sort': ranking.sort_by, 'order': ranking.order, 'per_page': per_page},
+        app.config['GITHUB_PAGE_CACHE_EX'])
+
+    repositories, last_page = fetch_page(1)
+    page_count = min(last_page, math.ceil(top_n / per_page))
+
+    if page_count > 1:
+        pages = range(2, page_count + 1)
+        max_workers = min(app.config['GITHUB_MAX_CONCURRENT_PAGES'], len(pages))
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='github-page') as executor:
+            # Run each page in a copy of the caller's context, so its spans land in the request's profile
+            futures = [executor.submit(contextvars.copy_context().run, fetch_page, page) for page in pages]
+
+            for future in futures:
+                page_repositories, _ = future.result()
+                repositories.extend(page_repositories)
+
+    return repositories[:top_n]
+
+
+def _get_search_query(ranking):
+    """
+    Returns the GitHub search query of a ranking's filters.
     """
-    Retrieve a list of up to 100 GitHub repositories sorted by the given criteria.
+    qualifiers = ['stars:>0']
+
+    if ranking.language:
+        qualifiers.append(f"language:{ranking.language}")
+
+    if ranking.topic:
+        qualifiers.append(f"topic:{ranking.topic}")
+
+    return ' '.join(qualifiers)
+
+
+def _fetch_repositories_page(client, redis_client, url, params, page_cache_ex, page):
+    """
+    Fetch a single page of GitHub search results.
+
+    Runs in worker threads, so it gets everything it needs as arguments instead of from the app context.
 
     Args:
-        session (requests.Session): A session object to use for making HTTP requests.
-        sort_by (str): The field to sort the repositories by. Valid values are 'stars', 'forks', and 'updated'.
-        order (str): The order to sort the repositories in. Valid values are 'asc' and 'desc'.
-        per_page (int): The number of repositories to retrieve per page.
+        client (GitHubClient): The client used to make requests to GitHub API.
+        redis_client (redis.Redis or None): Redis client used to store the page and its ETag.
+        url (str): The search URL.
+        params (dict): The search query parameters, without the page number.
+        page_cache_ex (int): Expiration time in seconds of the stored page.
+        page (int): The page number.
 
     Returns:
-        list: A list of up to 100 repositories, represented as dictionaries with the following keys:
-            - id (int): The ID of the repository.
-            - name (str): The name of the repository.
-            - description (str): The description of the repository.
-            - owner (dict): A dictionary representing the owner of the repository, with the following keys:
-                - id (int): The ID of the owner.
-                - login (str): The username of the owner.
-                - avatar_url (str): The URL of the owner's avatar image.
-                - html_url (str): The URL of the owner's GitHub profile.
-            - html_url (str): The URL of the repository on GitHub.
-            - clone_url (str): The URL to use for cloning the repository.
-            - language (str): The primary language of the repository.
-            - topics (list): A list of topics associated with the repository.
-            - stars (int): The number of stars the repository has.
-            - forks_count (int): The number of forks the repository has.
-            - created_at (str): The date and time the repository was created, in ISO 8601 format.
-            - updated_at (str): The date and time the repository was last updated, in ISO 8601 format.
-            - pushed_at (str): The date and time of the last push to the repository, in ISO 8601 format.
-            - archived (bool): Whether the repository is archived.
-            - visibility (str): The visibility of the repository. Valid values are 'public', 'private', and 'internal'.
-            - watchers_count (int): The number of users watching the repository.
-            - open_issues_count (int): The number of open issues in the repository.
-    """
-def _get_repositories_from_github(session, sort_by, order, per_page):
-    
-    repositories = []
-    page = 1
-    params = {'q': f'stars:>0', 'sort': sort_by,
-              'order': order, 'per_page': per_page, 'page': 1}
-    
-    while len(repositories) < 100:
-        params['page'] = page
+        tuple: The page's repositories and the number of the last page.
 
+    Raises:
+        GitHubAPIError: If the page could not be retrieved.
+    """
+    params = dict(params, page=page)
+    page_key = 'github_page:' + hashlib.sha1(
+        f"{url}?{sorted(params.items())}".encode()).hexdigest()
+    cached_page = get_hash_from_cache(redis_client, page_key) if redis_client else None
+    headers = {}
+
+    # Pages cached in an older format are fetched again
+    if cached_page and 'records' not in cached_page:
+        cached_page = None
+
+    if cached_page:
+        headers['If-None-Match'] = cached_page['etag'].decode()
+
+    # Rate limits, timeouts and server errors are retried by the client
+    response = client.get(url, params=params, headers=headers)
+
+    if response.status_code == 304 and cached_page:
+        logger.info(f"Page {page} of GitHub search results did not change")
+
+        return unpack_records(cached_page['records']), int(cached_page['last_page'])
+    elif response.status_code == 200:
         try:
-            response = session.get(
-                app.config['GITHUB_API_SEARCH_REPOS_URL'], params=params)
-        except requests.exceptions.Timeout:
-            logger.error(
-                f"Time out while retrieving a bulk of repos from GitHub API.")
-            
-            break
-        except requests.exceptions.RequestException as e:
-            logger.error(
-                f"RequestException: {e} while retrieving a bulk of repos from GitHub API.")
-            
-            break
+            data = response.json().get('items', [])
+            logger.info(f"Retrieved {len(data)} repos from GitHub API")
+        except ValueError as e:
+            raise GitHubAPIError(
+                f"Falied to parse response from GitHub API. Error: {e}")
 
-        if response.status_code == 200:
+        repositories = []
+
+        for repo in data:
             try:
-                data = response.json().get('items', [])
-                logger.info(f"Retrieved {len(data)} repos from GitHub API")
-            except ValueError as e:
-                logger.error(
-                    f"Falied to parse response from GitHub API. Error: {e}")
-                
-                break
-
-            for repo in data:
-                try:
-                    owner_data = repo['owner']
-                    owner = {
-                        'id': owner_data['id'],
-                        'login': owner_data['login'],
-                        'avatar_url': owner_data['avatar_url'],
-                        'html_url': owner_data['html_url']
-                    }
-                    repositories.append({
-                        'id': repo['id'],
-                        'name': repo['name'],
-                        'description': repo['description'],
-                        'owner': owner,
-                        'html_url': repo['html_url'],
-                        'clone_url': repo['clone_url'],
-                        'language': repo['language'],
-                        'topics': repo['topics'],
-                        'stars': repo['stargazers_count'],
-                        'forks_count': repo['forks_count'],
-                        'created_at': repo['created_at'],
-                        'updated_at': repo['updated_at'],
-                        'pushed_at': repo['pushed_at'],
-                        'archived': repo['archived'],
-                        'visibility': repo['visibility'],
-                        'watchers_count': repo['watchers_count'],
-                        'open_issues_count': repo['open_issues_count']
-                    })
-                except KeyError as e:
-                    logger.warning(
-                        f"KeyError: {e} in repo: {repo}. Skipping repo.")
-        elif response.status_code == 403 and 'X-RateLimit-Remaining' in response.headers \
-                and response.headers['X-RateLimit-Remaining'] == '0':
-            logger.error(
-                f"GitHub API rate limit exceeded.")
-            
-            break
-        elif  response.status_code == 403 and 'Retry-After' in response.headers:
-            retry_after = response.headers['Retry-After']
-            logger.error(f'GitHub API abuse detection triggered. Retry after {retry_after} seconds.')
+                repositories.append(RepositoryRecord.from_github(repo))
+            except KeyError as e:
+                logger.warning(
+                    f"KeyError: {e} in repo {repo.get('id')}. Skipping repo.")
 
-            break
-        else:
-            logger.error(
-                f"Failed to retrieve top 100 repos by stars. "
-                f"Status code: {response.status_code}, Response: {response.text}")
-            
-            break
+        last_page = _get_last_page(response, page)
 
-        # Check if there is next page. If not, break the loop
-        if 'link' in response.headers:
-            links = response.headers['link'].split(',')
-            for link in links:
-                if 'rel="next"' in link:
+        if redis_client and 'ETag' in response.headers:
+            set_hash_in_cache(redis_client, page_key, {
+                'etag': response.headers['ETag'],
+                'records': pack_records(repositories),
+                'last_page': last_page
+            }, page_cache_ex)
 
-                    break
-            else:
-                break
-        else:
-            break
+        return repositories, last_page
+
+    raise GitHubAPIError(
+        f"Failed to retrieve page {page} of repos. "
+        f"Status code: {response.status_code}, Response: {response.text[:LOGGED_RESPONSE_MAX_LENGTH]}")
+
+
+def _get_last_page(response, page):
+    """
+    Get the number of the last page of results from the response's link header.
+
+    Args:
+        response (requests.Response): A response of GitHub search API.
+        page (int): The number of the page the response is for.
+
+    Returns:
+        int: The number of the last page.
+    """
+    links = response.links
+
+    if 'last' in links:
+        query = parse_qs(urlparse(links['last']['url']).query)
+
+        return int(query['page'][0])
 
-        page += 1
-        
-    return repositories[:100]
+    # The last page itself has no "last" link, only "prev" and "first"
+    return page + 1 if 'next' in links else page
 
 
 def create_session(token=None):
@@ -159,41 +231,457 @@ def create_session(token=None):
     return session
 
 
-def get_top_100_repos_by_stars(session, sort_by='stars', order='desc', per_page=100):
+def get_github_client():
     """
-    Retrieves the top 100 repositories from GitHub API sorted by stars.
+    Returns the process-wide GitHub API client, created on first use from the app config.
+
+    The client spreads requests over every token in GITHUB_TOKENS, or sends them
+    unauthenticated if there are none.
+    """
+    global _github_client
+
+    with _github_client_lock:
+        if _github_client is None:
+            tokens = app.config['GITHUB_TOKENS'] or [None]
+            _github_client = GitHubClient(
+                [create_session(token) for token in tokens],
+                max_retries=app.config['GITHUB_MAX_RETRIES'],
+                backoff_base=app.config['GITHUB_BACKOFF_BASE'],
+                backoff_max=app.config['GITHUB_BACKOFF_MAX'],
+                max_wait=app.config['GITHUB_MAX_RATE_LIMIT_WAIT'],
+                timeout=app.config['GITHUB_REQUEST_TIMEOUT'])
+
+        return _github_client
+
+
+def refresh_top_repos_cache(client, ranking=DEFAULT_RANKING):
+    """
+    Fetches a ranking's top repositories from GitHub API and stores them in the cache.
+
+    The cache holds the final response body, already serialized and compressed, together with
+    its ETag and the time it was fetched. Readers can tell fresh data (younger than CACHE_SOFT_TTL)
+    from stale data. Redis drops the entry after CACHE_EX (the hard TTL).
+
+    Concurrent refreshes of the same entry are coalesced, so only one GitHub fetch runs at a time
+    across the cluster: a single-flight within the process, and a Redis lease lock between
+    workers and replicas. Callers that don't get the lease wait for the holder's result.
 
     Args:
-        session: A requests.Session object used to make HTTP requests.
-        sort_by: A string representing the field to sort the repositories by. Default is 'stars'.
-        order: A string representing the order to sort the repositories in. Default is 'desc'.
-        per_page: An integer representing the number of repositories to retrieve per page. Default is 100.
+        client: A GitHubClient used to make requests to GitHub API.
+        ranking (Ranking, optional): The ranking to refresh. Defaults to the top 100 repositories by stars.
 
     Returns:
-        A list of dictionaries representing the top 100 repositories sorted by stars.
+        dict: The response payload, see _build_payload.
+
+    Raises:
+        GitHubAPIError: If the repositories could not be retrieved. Nothing is cached then.
     """
+    cache_key = _get_top_repos_cache_key(ranking)
 
-    redis_client = create_redis_client()
-    cache_key = f"top_repos:{sort_by}:{order}:{per_page}"
+    return _refreshes.do(cache_key, lambda: _refresh_under_lease(
+        client, cache_key, ranking))
 
-    # Check cache for data
-    if redis_client:
-        data = get_from_cache(redis_client, cache_key)
 
-        if data:
-            logger.info(f"Retrieved top 100 repos by stars from cache")
+def _refresh_under_lease(client, cache_key, ranking):
+    """
+    Refreshes a top repositories cache entry while holding its Redis lease lock.
 
-            return data
+    If another worker holds the lease, polls the cache until that worker stores a new entry,
+    taking over the lease if it expires. After REFRESH_LOCK_WAIT seconds without a result,
+    fetches without the lease rather than failing the request. If Redis can't be reached,
+    fetches right away: there is no lease to wait for, nor a cache to store the result in.
+    """
+    redis_client = get_redis_client()
+    lock_name = f"lock:{cache_key}"
+    previous_payload = _load_payload(redis_client, cache_key)
+    previous_fetched_at = previous_payload['fetched_at'] if previous_payload else None
+    deadline = time.time() + app.config['REFRESH_LOCK_WAIT']
 
-    # Get data from GitHub API, after could not retrieve from cache
+    while True:
+        try:
+            token = acquire_lock(redis_client, lock_name, app.config['REFRESH_LOCK_TTL_MS'])
+        except RedisError as e:
+            logger.error(f"Failed to acquire the refresh lease of {cache_key}. Fetching without it. Error: {e}")
+
+            return _build_payload(_fetch_and_store_repositories(client, ranking))
+
+        payload = _load_payload(redis_client, cache_key)
+
+        # Someone else refreshed the entry while we were waiting (or before we got the lease)
+        if payload is not None and payload['fetched_at'] != previous_fetched_at:
+            if token is not None:
+                release_lock(redis_client, lock_name, token)
+            logger.info(f"{cache_key} was refreshed by another worker")
+
+            return payload
+
+        if token is not None:
+            break
+
+        if time.time() >= deadline:
+            logger.warning(
+                f"Timed out waiting for the refresh lease of {cache_key}. Fetching without it.")
+
+            break
+
+        time.sleep(app.config['REFRESH_LOCK_POLL_INTERVAL'])
+
+    try:
+        repositories = _fetch_and_store_repositories(client, ranking)
+        payload = _build_payload(repositories)
+
+        if token is None:
+            set_hash_in_cache(redis_client, cache_key, payload, app.config['CACHE_EX'])
+        # Don't overwrite the entry if the lease expired and someone else took over meanwhile
+        elif not set_hash_if_lock_held(redis_client, cache_key, payload, app.config['CACHE_EX'], lock_name, token):
+            logger.warning(
+                f"Lost the refresh lease of {cache_key} while fetching. Not saving to cache.")
+
+            return payload
+
+        # Only once the entry is saved, and still under the lease, so a stale holder can't bump the version
+        version = update_snapshot(redis_client, cache_key, repositories, app.config['SNAPSHOT_EX'],
+                                  app.config['CHANGE_LOG_MAX_SIZE'], (lock_name, token) if token is not None else None)
+
+        if version is not None:
+            payload['version'] = version
+
+        get_top_repos_cache().invalidate(cache_key)
+        logger.info(f"Saved {cache_key} to cache")
+
+        return payload
+    finally:
+        if token is not None:
+            release_lock(redis_client, lock_name, token)
+
+
+def _fetch_and_store_repositories(client, ranking):
+    """
+    Fetches repositories from GitHub API, and keeps the shared repositories store up to date with them.
+    """
     repositories = _get_repositories_from_github(
-        session, sort_by, order, per_page)
+        client, ranking, app.config['GITHUB_SEARCH_PER_PAGE'])
+    _store_repositories(repositories)
+
+    return repositories
+
+
+def _store_repositories(repositories):
+    """
+    Caches repositories one by one for get_repositories_by_ids, and saves them to the shared repositories store.
+    """
+    redis_client = get_redis_client()
 
-    # Save data to cache
     if redis_client:
-        set_in_cache(redis_client, cache_key,
-                     repositories, app.config['CACHE_EX'])
-        logger.info(f"Saved top 100 repos by stars to cache")
-        close_redis_client(redis_client)
+        set_many_in_cache(redis_client, {_get_repository_cache_key(repository.id): repository
+                                         for repository in repositories},
+                          app.config['REPOSITORY_CACHE_EX'], dumps=pack_record)
+
+    if app.config['REPOSITORY_STORE_ENABLED']:
+        save_repositories([repository.to_dict() for repository in repositories])
+
+
+def get_repositories_by_ids(client, repository_ids):
+    """
+    Retrieves repositories by their GitHub IDs.
+
+    Repositories are answered from the cache, which every fetch of top repositories fills.
+    Only the ones that are not cached are fetched from GitHub API, concurrently, and at most
+    REPOSITORY_LOOKUP_MAX_FETCHES of them per call, so one call can't spend the core rate limit.
+
+    Args:
+        client: A GitHubClient used to make requests to GitHub API.
+        repository_ids (list): GitHub repository IDs.
+
+    Returns:
+        dict: The repositories that were found, as RepositoryRecords, by their ID. Repositories that don't exist,
+              could not be fetched, or are past the fetch cap are left out.
+    """
+    redis_client = get_redis_client()
+    cache_keys = [_get_repository_cache_key(repository_id) for repository_id in repository_ids]
+    cached = get_many_from_cache(redis_client, cache_keys, loads=unpack_record) if redis_client else []
+    repositories = {repository.id: repository for repository in cached if repository is not None}
+    missing_ids = [repository_id for repository_id in repository_ids if repository_id not in repositories]
+    max_fetches = app.config['REPOSITORY_LOOKUP_MAX_FETCHES']
+
+    if len(missing_ids) > max_fetches:
+        logger.warning(f"{len(missing_ids)} repositories are not cached, fetching only {max_fetches} from GitHub API")
+        missing_ids = missing_ids[:max_fetches]
+
+    if missing_ids:
+        fetch_repository = functools.partial(
+            _fetch_repository, client, app.config['GITHUB_API_BASE_URL'])
+        max_workers = min(app.config['GITHUB_MAX_CONCURRENT_PAGES'], len(missing_ids))
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='github-repo') as executor:
+            futures = [executor.submit(contextvars.copy_context().run, fetch_repository, repository_id)
+                       for repository_id in missing_ids]
+            fetched = [repository for repository in (future.result() for future in futures)
+                       if repository is not None]
+
+        _store_repositories(fetched)
+        repositories.update((repository.id, repository) for repository in fetched)
+        logger.info(f"Fetched {len(fetched)} of {len(missing_ids)} uncached repositories from GitHub API")
 
     return repositories
+
+
+def _fetch_repository(client, base_url, repository_id):
+    """
+    Fetch a single repository by its ID. Runs in worker threads, so it doesn't use the app context.
+
+    Returns:
+        RepositoryRecord or None: The repository, or None if it doesn't exist or could not be retrieved.
+    """
+    try:
+        response = client.get(f"{base_url}/repositories/{repository_id}")
+
+        if response.status_code == 200:
+            return RepositoryRecord.from_github(response.json())
+
+        if response.status_code != 404:
+            logger.error(
+                f"Failed to retrieve repository {repository_id}. Status code: {response.status_code}")
+    except (GitHubAPIError, ValueError, KeyError) as e:
+        logger.error(f"Failed to retrieve repository {repository_id}. Error: {e}")
+
+    return None
+
+
+def _get_repository_cache_key(repository_id):
+    return f"repository:{repository_id}"
+
+
+def prewarm_top_repos_cache():
+    """
+    Refreshes the cache entries of the popular rankings (PRECOMPUTED_RANKINGS) that are missing or about to go stale.
+
+    Meant to run periodically in the background, so user-facing requests for these rankings find a fresh entry
+    and never wait on GitHub API. A ranking that fails is retried on the next run, the others are still refreshed.
+    """
+    redis_client = get_redis_client()
+    client = get_github_client()
+
+    for ranking in get_precomputed_rankings():
+        cache_key = _get_top_repos_cache_key(ranking)
+        payload = _load_payload(redis_client, cache_key) if redis_client else None
+
+        if payload is not None and time.time() - payload['fetched_at'] < app.config['CACHE_PREWARM_INTERVAL']:
+            continue
+
+        try:
+            refresh_top_repos_cache(client, ranking)
+        except GitHubAPIError as e:
+            logger.error(f"Failed to pre-warm {cache_key}. Error: {e}")
+
+
+def get_precomputed_rankings():
+    """
+    Returns the rankings listed in PRECOMPUTED_RANKINGS, with the defaults of DEFAULT_RANKING for missing criteria.
+    """
+    return [DEFAULT_RANKING._replace(**criteria) for criteria in app.config['PRECOMPUTED_RANKINGS']]
+
+
+def get_top_repos_payload(client, ranking=DEFAULT_RANKING):
+    """
+    Retrieves a ranking's top repositories response payload, ready to be sent as is.
+
+    Rankings are cached by limit bucket: the payload holds the top `_get_bucket_limit(ranking.limit)`
+    repositories, shared by every limit of the bucket, and project_payload cuts it down to the ranking's limit.
+    Cached data is served stale-while-revalidate: once it is
+    older than CACHE_SOFT_TTL it is still returned right away, and a background worker refreshes it.
+    GitHub API is only queried inline when there is nothing in the cache, once for all the concurrent
+    requests of the same ranking (see refresh_top_repos_cache).
+
+    Args:
+        client: A GitHubClient used to make requests to GitHub API.
+        ranking (Ranking, optional): The ranking to retrieve. Defaults to the top 100 repositories by stars.
+
+    Returns:
+        dict: The response payload, see _build_payload.
+    """
+
+    redis_client = get_redis_client()
+    cache_key = _get_top_repos_cache_key(ranking)
+
+    # Check cache for data
+    if redis_client:
+        payload = get_top_repos_cache().get(
+            cache_key, lambda key: _load_payload(redis_client, key))
+
+        if payload is not None:
+            if time.time() - payload['fetched_at'] > app.config['CACHE_SOFT_TTL']:
+                def refresh():
+                    refresh_top_repos_cache(client, ranking)
+
+                schedule_refresh(app._get_current_object(), cache_key, refresh)
+
+            logger.info(f"Retrieved {cache_key} from cache")
+
+            return payload
+
+    # Get data from GitHub API, after could not retrieve from cache
+    return refresh_top_repos_cache(client, ranking)
+
+
+def get_top_repos_changes(ranking, since):
+    """
+    Retrieves the changes of a ranking since a version, so clients can poll for deltas instead of full downloads.
+    Rankings are versioned by limit bucket (see _get_bucket_limit), like they are cached.
+
+    Args:
+        ranking (Ranking): The ranking.
+        since (int): The version the client has, from the version of a previous payload or changes response.
+
+    Returns:
+        tuple: The ranking's current version, and the changes of every later version, oldest first.
+               The changes are None if they are no longer available since that version.
+               Returns None if the changes could not be retrieved.
+    """
+    redis_client = get_redis_client()
+
+    if not redis_client:
+        return None
+
+    try:
+        return get_changes(redis_client, _get_top_repos_cache_key(ranking), since)
+    except RedisError as e:
+        logger.error(f"Failed to retrieve the changes of {_get_top_repos_cache_key(ranking)}. Error: {e}")
+
+        return None
+
+
+def get_top_100_repos_by_stars(client):
+    """
+    Retrieves the top 100 repositories from GitHub API sorted by stars.
+
+    Args:
+        client: A GitHubClient used to make requests to GitHub API.
+
+    Returns:
+        A list of dictionaries representing the top 100 repositories sorted by stars.
+    """
+    payload = get_top_repos_payload(client, DEFAULT_RANKING)
+
+    return [repository.to_dict() for repository in unpack_records(payload['records'])]
+
+
+def project_payload(payload, fields, limit=None):
+    """
+    Restricts a response payload to its top `limit` repositories, and to some of the repository fields.
+
+    Projected payloads are built from the cached records in-process, and kept until their
+    full payload changes, so each one is serialized and compressed only once.
+
+    Args:
+        payload (dict): A full response payload, see _build_payload.
+        fields (tuple): The fields to keep, out of REPOSITORY_FIELDS, in that order.
+        limit (int, optional): The number of repositories to keep. Defaults to all of them.
+
+    Returns:
+        dict: The projected payload, see _build_payload.
+    """
+    global _projected_payloads
+
+    # A limit that is a whole bucket is the cached payload itself
+    if fields == REPOSITORY_FIELDS and (limit is None or limit == _get_bucket_limit(limit)):
+        return payload
+
+    with _projected_payloads_lock:
+        if _projected_payloads is None:
+            _projected_payloads = LocalCache(app.config['PROJECTED_PAYLOADS_MAX_SIZE'], app.config['CACHE_EX'])
+
+    key = (payload['etag'], fields, limit)
+    projected = _projected_payloads.get(key)
+
+    if projected is None:
+        projected = _build_payload(unpack_records(payload['records'])[:limit], fields, payload['fetched_at'])
+        _projected_payloads.set(key, projected)
+
+    return projected
+
+
+def get_top_repos_cache():
+    """
+    Returns the two-tier (in-process and Redis) cache of top repositories payloads.
+    """
+    global _top_repos_cache
+
+    if _top_repos_cache is None:
+        _top_repos_cache = TwoTierCache(
+            'top_repos', app.config['L1_CACHE_MAX_SIZE'], app.config['L1_CACHE_TTL'])
+
+    return _top_repos_cache
+
+
+def _get_top_repos_cache_key(ranking):
+    return (f"top_repos:{ranking.sort_by}:{ranking.order}:{ranking.language or '*'}:"
+            f"{ranking.topic or '*'}:{_get_bucket_limit(ranking.limit)}")
+
+
+def _get_bucket_limit(limit):
+    """
+    Rounds a ranking limit up to a multiple of RANKING_LIMIT_BUCKET_SIZE, at most GITHUB_SEARCH_MAX_RESULTS.
+    Rankings are fetched and cached for the whole bucket, so nearby limits share one cache entry.
+    """
+    bucket_size = app.config['RANKING_LIMIT_BUCKET_SIZE']
+
+    return min(math.ceil(limit / bucket_size) * bucket_size, app.config['GITHUB_SEARCH_MAX_RESULTS'])
+
+
+def _build_payload(repositories, fields=REPOSITORY_FIELDS, fetched_at=None):
+    """
+    Serializes repositories into the final response body, once per supported content encoding.
+
+    Args:
+        repositories (list): The repositories, as RepositoryRecords.
+        fields (tuple, optional): The fields to serialize, out of REPOSITORY_FIELDS. Defaults to all of them.
+        fetched_at (float, optional): When the repositories were fetched. Defaults to now.
+
+    Returns:
+        dict: The payload, with the following keys:
+            - fetched_at (float): When the repositories were fetched, as a Unix timestamp.
+            - etag (str): The ETag of the response body.
+            - version (int): The ranking's version, see get_top_repos_changes. Added once the payload is cached.
+            - records (bytes): The repositories, packed with pack_records. Only in full payloads.
+            - identity (bytes): The uncompressed JSON body.
+            - gzip (bytes): The gzip compressed JSON body.
+            - br (bytes): The brotli compressed JSON body, only if brotli is installed.
+    """
+    body = orjson.dumps([repository.to_dict(fields) for repository in repositories])
+    payload = {
+        'fetched_at': time.time() if fetched_at is None else fetched_at,
+        'etag': hashlib.sha1(body).hexdigest(),
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=app.config['GZIP_COMPRESS_LEVEL'])
+    }
+
+    if fields == REPOSITORY_FIELDS:
+        payload['records'] = pack_records(repositories)
+
+    if brotli is not None:
+        payload['br'] = brotli.compress(body)
+
+    return payload
+
+
+def _load_payload(redis_client, cache_key):
+    """
+    Loads a payload stored by _build_payload from the cache.
+
+    Returns:
+        dict or None: The payload, or None if there is no usable entry.
+    """
+    cached_data = get_hash_from_cache(redis_client, cache_key)
+
+    # Entries cached in an older format are fetched again
+    if not cached_data or not {'fetched_at', 'identity', 'records'} <= cached_data.keys():
+        return None
+
+    cached_data['fetched_at'] = float(cached_data['fetched_at'])
+    cached_data['etag'] = cached_data['etag'].decode()
+
+    if 'version' in cached_data:
+        cached_data['version'] = int(cached_data['version'])
+
+    return cached_data
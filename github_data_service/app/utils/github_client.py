@@ -0,0 +1,260 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+
+from utils.app_logging import logger
+from utils.metrics import observe, count_error
+
+
+class GitHubAPIError(Exception):
+    """
+    Raised when GitHub API could not be queried successfully, even after retries.
+    """
+
+
+class RateLimitExceeded(GitHubAPIError):
+    """
+    Raised when every token is out of budget for longer than the client is allowed to wait,
+    or when GitHub API still rate limits a request after every retry.
+
+    Args:
+        retry_after (float): Seconds until a token gets budget again.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"GitHub API rate limit exceeded. Retry after {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+class _TokenState:
+    """
+    A session of one token, and its remaining budget per GitHub rate limit resource ('core', 'search', ...).
+    """
+
+    def __init__(self, index, session):
+        self.index = index
+        self.session = session
+        self.remaining = {}
+        self.reset_at = {}
+        self.blocked_until = 0
+
+
+class GitHubClient:
+    """
+    Rate-limit-aware GitHub API client, spreading requests over a pool of tokens.
+
+    Keeps track of each token's remaining budget and reset time from the X-RateLimit-* response
+    headers, and sends every request with the token that has the most budget left. When every token
+    is out of budget, waits for the earliest reset (up to `max_wait` seconds). Rate limited and
+    failed requests are retried with jittered exponential backoff, honoring Retry-After.
+
+    Args:
+        sessions (list): A requests.Session per token, see create_session.
+        max_retries (int): How many times a request is retried.
+        backoff_base (float): Backoff of the first retry, in seconds. Doubles on every retry.
+        backoff_max (float): Maximum backoff between retries, in seconds.
+        max_wait (float): Maximum time to wait for a rate limit to reset, in seconds.
+        timeout (float): Timeout of each request, in seconds.
+    """
+
+    def __init__(self, sessions, max_retries=3, backoff_base=1, backoff_max=30, max_wait=60, timeout=10):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._tokens = [_TokenState(index, session) for index, session in enumerate(sessions)]
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, headers=None):
+        """
+        Send a GET request to GitHub API.
+
+        Args:
+            url (str): The URL to request.
+            params (dict, optional): Query parameters.
+            headers (dict, optional): Extra headers, e.g. If-None-Match.
+
+        Returns:
+            requests.Response: The response. Rate limited and 5xx responses are retried, not returned.
+
+        Raises:
+            RateLimitExceeded: If every token is out of budget for longer than max_wait,
+                or the last attempt was rate limited too.
+            GitHubAPIError: If the request kept failing after max_retries retries.
+        """
+        resource = 'search' if '/search/' in url else 'core'
+        # How long the last attempt was told to wait, if it was rate limited
+        rate_limited_for = None
+
+        for attempt in range(self.max_retries + 1):
+            token = self._acquire_token(resource)
+
+            try:
+                with observe('github', resource):
+                    response = token.session.get(
+                        url, params=params, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Request to GitHub API failed ({e}). Attempt {attempt + 1}.")
+                rate_limited_for = None
+                self._sleep(self._backoff(attempt))
+
+                continue
+
+            self._update_budget(token, resource, response)
+            retry_after = self._get_retry_after(response, attempt)
+            rate_limited_for = retry_after
+
+            if retry_after is not None:
+                count_error('github', resource)
+                logger.warning(
+                    f"GitHub API rate limited token #{token.index} ({response.status_code}). "
+                    f"Retrying in {retry_after:.1f} seconds.")
+                with self._lock:
+                    token.blocked_until = time.time() + retry_after
+
+                continue
+
+            if response.status_code >= 500:
+                count_error('github', resource)
+                logger.warning(
+                    f"GitHub API returned {response.status_code}. Attempt {attempt + 1}.")
+                self._sleep(self._backoff(attempt))
+
+                continue
+
+            return response
+
+        if rate_limited_for is not None:
+            raise RateLimitExceeded(rate_limited_for)
+
+        raise GitHubAPIError(f"Request to {url} failed after {self.max_retries + 1} attempts")
+
+    def close(self):
+        for token in self._tokens:
+            token.session.close()
+
+    def _acquire_token(self, resource):
+        """
+        Pick the token with the most budget left for a resource, waiting if none has any.
+
+        One request is reserved from the picked token's budget, so concurrent requests don't
+        all pick the same token and overshoot it.
+        """
+        deadline = time.time() + self.max_wait
+
+        while True:
+            with self._lock:
+                now = time.time()
+                available = [token for token in self._tokens
+                             if token.blocked_until <= now and self._remaining(token, resource, now) > 0]
+
+                if available:
+                    token = max(available, key=lambda t: self._remaining(t, resource, now))
+
+                    if resource in token.remaining:
+                        token.remaining[resource] -= 1
+
+                    return token
+
+                wait = min(self._available_at(token, resource) for token in self._tokens) - now
+
+            if now + wait > deadline:
+                raise RateLimitExceeded(wait)
+
+            logger.warning(f"Every GitHub token is out of {resource} budget. Waiting {wait:.1f} seconds.")
+            self._sleep(wait)
+
+    def _update_budget(self, token, resource, response):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset_at = response.headers.get('X-RateLimit-Reset')
+        resource = response.headers.get('X-RateLimit-Resource', resource)
+
+        if remaining is None or reset_at is None:
+            return
+
+        with self._lock:
+            token.remaining[resource] = int(remaining)
+            token.reset_at[resource] = int(reset_at)
+
+    def _get_retry_after(self, response, attempt):
+        """
+        Returns how long to wait before retrying a rate limited response (with jitter),
+        or None if the response isn't rate limited.
+
+        Retry-After is either a number of seconds or an HTTP date. A value that is neither
+        falls back to the backoff of the attempt.
+        """
+        if response.status_code not in (403, 429):
+            return None
+
+        if 'Retry-After' in response.headers:
+            retry_after = _parse_retry_after(response.headers['Retry-After'])
+
+            if retry_after is None:
+                logger.warning(f"Invalid Retry-After header: {response.headers['Retry-After']}")
+
+                return self._backoff(attempt)
+
+            return retry_after + random.uniform(0, self.backoff_base)
+
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset_at = int(response.headers.get('X-RateLimit-Reset', time.time()))
+
+            return max(reset_at - time.time(), 0) + random.uniform(0, self.backoff_base)
+
+        return None
+
+    def _backoff(self, attempt):
+        # "Full jitter" - spreads retries of concurrent requests apart
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _remaining(self, token, resource, now):
+        # Unknown budget (no request sent yet) or reset budget counts as available
+        if resource not in token.remaining or token.reset_at[resource] <= now:
+            return float('inf')
+
+        return token.remaining[resource]
+
+    def _available_at(self, token, resource):
+        available_at = token.blocked_until
+
+        if token.remaining.get(resource, 1) <= 0:
+            available_at = max(available_at, token.reset_at[resource])
+
+        return available_at
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+def _parse_retry_after(value):
+    """
+    Returns the seconds to wait of a Retry-After header, given in seconds or as an HTTP date,
+    or None if the value is invalid.
+    """
+    try:
+        seconds = float(value)
+
+        return max(seconds, 0) if math.isfinite(seconds) else None
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+    if retry_at is None:
+        return None
+
+    # HTTP dates are in GMT
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
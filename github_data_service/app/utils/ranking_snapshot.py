@@ -0,0 +1,199 @@
+import time
+import orjson
+from redis.exceptions import RedisError, WatchError
+
+from utils.app_logging import logger
+
+# Every ranking keeps, next to its cached payload:
+#   {name}:snapshot - sorted set of the repository IDs, scored by rank
+#   {name}:stars    - hash of the star count of each repository, by ID
+#   {name}:version  - incremented on every refresh that changes the ranking
+#   {name}:changes  - list of the latest changes (newest first), one JSON entry per version
+
+
+def update_snapshot(client, name, repositories, ex, max_changes, fence=None):
+    """
+    Diffs a ranking's new repositories against its previous snapshot, and stores the changes.
+
+    Only what changed is written: the ranks of repositories that moved, entered or left, and the star counts
+    that changed. A refresh that changes nothing keeps the current version. The ranking's cache entry
+    (the hash at `name`) is tagged with the version, in the same transaction.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        name (str): The ranking's cache key.
+        repositories (list): The ranking's repositories, as RepositoryRecords, in rank order.
+        ex (int): Expiration time in seconds of the snapshot.
+        max_changes (int): The number of versions kept in the change log.
+        fence (tuple, optional): A lease lock name and the fencing token it was acquired with (see acquire_lock).
+            The update is only applied while the lock is still held with that token.
+
+    Returns:
+        int or None: The ranking's version after the update, or None if the snapshot could not be updated.
+    """
+    try:
+        with client.pipeline(transaction=False) as pipe:
+            pipe.zrange(f"{name}:snapshot", 0, -1, withscores=True)
+            pipe.hgetall(f"{name}:stars")
+            pipe.get(f"{name}:version")
+            previous_ranks, previous_stars, version = pipe.execute()
+
+        previous_ranks = {int(repository_id): int(rank) for repository_id, rank in previous_ranks}
+        previous_stars = {int(repository_id): int(stars) for repository_id, stars in previous_stars.items()}
+        version = int(version or 0)
+        ranks = {repository.id: rank for rank, repository in enumerate(repositories, start=1)}
+        stars = {repository.id: repository.stars for repository in repositories}
+        changes = _diff(previous_ranks, previous_stars, repositories)
+
+        if changes is None and version:
+            with client.pipeline() as pipe:
+                _start_transaction(pipe, fence)
+                pipe.hset(name, 'version', version)
+
+                for key in ('snapshot', 'stars', 'version', 'changes'):
+                    pipe.expire(f"{name}:{key}", ex)
+
+                pipe.execute()
+
+            return version
+
+        with client.pipeline() as pipe:
+            _start_transaction(pipe, fence)
+            left = [repository_id for repository_id in previous_ranks if repository_id not in ranks]
+
+            if left:
+                pipe.zrem(f"{name}:snapshot", *left)
+                pipe.hdel(f"{name}:stars", *left)
+
+            changed_ranks = {repository_id: rank for repository_id, rank in ranks.items()
+                             if previous_ranks.get(repository_id) != rank}
+            changed_stars = {repository_id: count for repository_id, count in stars.items()
+                             if previous_stars.get(repository_id) != count}
+
+            if changed_ranks:
+                pipe.zadd(f"{name}:snapshot", changed_ranks)
+
+            if changed_stars:
+                pipe.hset(f"{name}:stars", mapping=changed_stars)
+
+            version += 1
+            pipe.set(f"{name}:version", version)
+            pipe.hset(name, 'version', version)
+
+            # The first snapshot has nothing to diff against, clients start from a full download
+            if previous_ranks and changes is not None:
+                changes['version'] = version
+                changes['changed_at'] = time.time()
+                pipe.lpush(f"{name}:changes", orjson.dumps(changes))
+                pipe.ltrim(f"{name}:changes", 0, max_changes - 1)
+
+            for key in ('snapshot', 'stars', 'version', 'changes'):
+                pipe.expire(f"{name}:{key}", ex)
+
+            pipe.execute()
+
+        logger.info(f"Updated the snapshot of {name} to version {version}")
+
+        return version
+    except WatchError:
+        logger.warning(f"Lost the refresh lease of {name}. Not updating its snapshot.")
+
+        return None
+    except RedisError as e:
+        logger.error(f"Failed to update the snapshot of {name}. Error: {e}")
+
+        return None
+
+
+def _start_transaction(pipe, fence):
+    """
+    Starts the transaction of a snapshot update. With a fence, the transaction only commits if the fence's
+    lock is still held with its token: the lock is watched, and WatchError is raised if it changes.
+    """
+    if fence is not None:
+        lock_name, token = fence
+        pipe.watch(lock_name)
+        holder = pipe.get(lock_name)
+
+        if holder is None or int(holder) != token:
+            raise WatchError(f"{lock_name} is no longer held with token {token}")
+
+    pipe.multi()
+
+
+def get_changes(client, name, since):
+    """
+    Retrieve the changes of a ranking since a version.
+
+    Args:
+        client (redis.Redis): Redis client instance.
+        name (str): The ranking's cache key.
+        since (int): The version the client has.
+
+    Returns:
+        tuple: The ranking's current version, and the changes of every later version, oldest first
+               (see _diff). The changes are None if the change log no longer covers `since`, and
+               the client has to download the full ranking again.
+
+    Raises:
+        RedisError: If the changes could not be read.
+    """
+    with client.pipeline(transaction=False) as pipe:
+        pipe.get(f"{name}:version")
+        pipe.lrange(f"{name}:changes", 0, -1)
+        version, entries = pipe.execute()
+
+    version = int(version or 0)
+
+    if since == version:
+        return version, []
+
+    changes = [orjson.loads(entry) for entry in reversed(entries)]
+
+    if since > version or not changes or since < changes[0]['version'] - 1:
+        return version, None
+
+    return version, [change for change in changes if change['version'] > since]
+
+
+def _diff(previous_ranks, previous_stars, repositories):
+    """
+    Compares a ranking's repositories with its previous snapshot.
+
+    Returns:
+        dict or None: None if nothing changed, otherwise the changes, with the following keys:
+            - entered (list): The repositories that entered the ranking, as {'rank', 'repository'}.
+            - left (list): The repositories that left the ranking, as {'id', 'rank'} with their previous rank.
+            - moved (list): The repositories whose rank changed, as {'id', 'from', 'to'}.
+            - stars (list): The repositories whose star count changed, as {'id', 'from', 'to'}.
+    """
+    ids = {repository.id for repository in repositories}
+    changes = {
+        'entered': [],
+        'left': [{'id': repository_id, 'rank': rank}
+                 for repository_id, rank in sorted(previous_ranks.items(), key=lambda item: item[1])
+                 if repository_id not in ids],
+        'moved': [],
+        'stars': []
+    }
+
+    for rank, repository in enumerate(repositories, start=1):
+        previous_rank = previous_ranks.get(repository.id)
+
+        if previous_rank is None:
+            changes['entered'].append({'rank': rank, 'repository': repository.to_dict()})
+
+            continue
+
+        if previous_rank != rank:
+            changes['moved'].append({'id': repository.id, 'from': previous_rank, 'to': rank})
+
+        previous_count = previous_stars.get(repository.id)
+
+        if previous_count is not None and previous_count != repository.stars:
+            changes['stars'].append({'id': repository.id, 'from': previous_count, 'to': repository.stars})
+
+    if not any(changes.values()):
+        return None
+
+    return changes
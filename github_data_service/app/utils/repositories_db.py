@@ -0,0 +1,57 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from flask import current_app as app
+
+from utils.db_manager import get_collection, get_database, get_mongo_client, get_client_options
+from utils.app_logging import logger
+
+
+def _get_repositories_collection():
+    """
+    Get the repositories collection using the process-wide pooled MongoClient.
+
+    Returns:
+        pymongo.collection.Collection: The repositories collection.
+    """
+    client = get_mongo_client(app.config['DB_URI'], **get_client_options(app.config))
+    db = get_database(client, app.config['DB_NAME'])
+
+    return get_collection(db, app.config['REPOSITORIES_COLLECTION'])
+
+
+def save_repositories(repositories):
+    """
+    Save freshly fetched repositories to the shared repositories store, keyed by their GitHub ID.
+
+    The store is the single copy of repository data that the favorites service reads from,
+    so every fetch keeps it fresh.
+
+    Args:
+        repositories (list): Repository dictionaries, as returned by _get_repositories_from_github.
+
+    Returns:
+        bool: True if the repositories were saved, False if an error occurred.
+    """
+    if not repositories:
+        return True
+
+    try:
+        collection = _get_repositories_collection()
+        synced_at = datetime.utcnow()
+        requests = [
+            UpdateOne({'_id': repository['id']},
+                      {'$set': dict({key: value for key, value in repository.items() if key != 'id'},
+                                    synced_at=synced_at)},
+                      upsert=True)
+            for repository in repositories
+        ]
+        result = collection.bulk_write(requests, ordered=False)
+        logger.info(
+            f"Saved {len(repositories)} repositories to the repositories store. "
+            f"New: {result.upserted_count}, updated: {result.modified_count}")
+
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save repositories to the repositories store. Error: {e}")
+
+        return False
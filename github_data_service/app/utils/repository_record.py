@@ -0,0 +1,124 @@
+from collections import namedtuple
+import msgpack
+
+# The repository fields served to clients, in order
+REPOSITORY_FIELDS = (
+    'id', 'name', 'description', 'owner', 'html_url', 'clone_url', 'language', 'topics', 'stars',
+    'forks_count', 'created_at', 'updated_at', 'pushed_at', 'archived', 'visibility',
+    'watchers_count', 'open_issues_count'
+)
+OWNER_FIELDS = ('id', 'login', 'avatar_url', 'html_url')
+
+_RECORD_FIELDS = tuple(
+    field for name in REPOSITORY_FIELDS
+    for field in ([f'owner_{owner_field}' for owner_field in OWNER_FIELDS] if name == 'owner' else [name]))
+
+
+class RepositoryRecord(namedtuple('RepositoryRecord', _RECORD_FIELDS)):
+    """
+    A repository, as a flat tuple with the owner's fields inlined.
+
+    Records take much less memory than the equivalent nested dicts, and are cached as msgpack arrays
+    (see pack_records), which carry no field names and decode much faster than JSON.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_github(cls, repo):
+        """
+        Extract the fields we serve from a GitHub repository object.
+
+        Args:
+            repo (dict): A repository object, as returned by GitHub API.
+
+        Returns:
+            RepositoryRecord: The repository.
+
+        Raises:
+            KeyError: If a field is missing from the repository object.
+        """
+        owner = repo['owner']
+
+        return cls(
+            repo['id'], repo['name'], repo['description'],
+            owner['id'], owner['login'], owner['avatar_url'], owner['html_url'],
+            repo['html_url'], repo['clone_url'], repo['language'], repo['topics'], repo['stargazers_count'],
+            repo['forks_count'], repo['created_at'], repo['updated_at'], repo['pushed_at'], repo['archived'],
+            repo['visibility'], repo['watchers_count'], repo['open_issues_count'])
+
+    def to_dict(self, fields=REPOSITORY_FIELDS):
+        """
+        Returns the repository as served to clients.
+
+        Args:
+            fields (tuple, optional): The fields to include, out of REPOSITORY_FIELDS. Defaults to all of them.
+
+        Returns:
+            dict: The repository, with the following keys (those in `fields`):
+                - id (int): The ID of the repository.
+                - name (str): The name of the repository.
+                - description (str): The description of the repository.
+                - owner (dict): A dictionary representing the owner of the repository, with the following keys:
+                    - id (int): The ID of the owner.
+                    - login (str): The username of the owner.
+                    - avatar_url (str): The URL of the owner's avatar image.
+                    - html_url (str): The URL of the owner's GitHub profile.
+                - html_url (str): The URL of the repository on GitHub.
+                - clone_url (str): The URL to use for cloning the repository.
+                - language (str): The primary language of the repository.
+                - topics (list): A list of topics associated with the repository.
+                - stars (int): The number of stars the repository has.
+                - forks_count (int): The number of forks the repository has.
+                - created_at (str): The date and time the repository was created, in ISO 8601 format.
+                - updated_at (str): The date and time the repository was last updated, in ISO 8601 format.
+                - pushed_at (str): The date and time of the last push to the repository, in ISO 8601 format.
+                - archived (bool): Whether the repository is archived.
+                - visibility (str): The visibility of the repository. Valid values are 'public', 'private', and 'internal'.
+                - watchers_count (int): The number of users watching the repository.
+                - open_issues_count (int): The number of open issues in the repository.
+        """
+        return {field: self._get_owner() if field == 'owner' else getattr(self, field) for field in fields}
+
+    def _get_owner(self):
+        return {
+            'id': self.owner_id,
+            'login': self.owner_login,
+            'avatar_url': self.owner_avatar_url,
+            'html_url': self.owner_html_url
+        }
+
+
+def pack_record(record):
+    """
+    Serializes a record to msgpack.
+    """
+    return msgpack.packb(record)
+
+
+def unpack_record(data):
+    """
+    Deserializes a record serialized by pack_record.
+
+    Raises:
+        ValueError: If the data is not a valid record.
+        TypeError: If the data is not a valid record.
+    """
+    return RepositoryRecord(*msgpack.unpackb(data))
+
+
+def pack_records(records):
+    """
+    Serializes a list of records to msgpack.
+    """
+    return msgpack.packb(records)
+
+
+def unpack_records(data):
+    """
+    Deserializes a list of records serialized by pack_records.
+
+    Raises:
+        ValueError: If the data is not a valid list of records.
+        TypeError: If the data is not a valid list of records.
+    """
+    return [RepositoryRecord(*row) for row in msgpack.unpackb(data)]
@@ -0,0 +1,62 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function. Callers that arrive while it is
+    running wait for it and get the same result (or exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run `fn` for `key`, or wait for the call that is already running for it.
+
+        Args:
+            key (str): Identifies calls that can share a result.
+            fn (callable): A function without arguments to run.
+
+        Returns:
+            The result of `fn`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = fn()
+
+            return call.result
+        except Exception as e:
+            call.error = e
+
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
@@ -6,6 +6,67 @@ DB_HOST = 'mongodb'
 DB_PORT = '27017'
 DB_URI = f'mongodb://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/'
 
+# MongoClient pool - one pooled client is shared by the whole process
+DB_MAX_POOL_SIZE = int(os.environ.get('DB_MAX_POOL_SIZE', 50))
+DB_MIN_POOL_SIZE = int(os.environ.get('DB_MIN_POOL_SIZE', 0))
+DB_MAX_IDLE_TIME_MS = int(os.environ.get('DB_MAX_IDLE_TIME_MS', 60 * 1000))
+DB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('DB_WAIT_QUEUE_TIMEOUT_MS', 2 * 1000))
+DB_CONNECT_TIMEOUT_MS = int(os.environ.get('DB_CONNECT_TIMEOUT_MS', 5 * 1000))
+DB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('DB_SERVER_SELECTION_TIMEOUT_MS', 5 * 1000))
+DB_SOCKET_TIMEOUT_MS = int(os.environ.get('DB_SOCKET_TIMEOUT_MS', 10 * 1000))
+DB_ENSURE_INDEXES = os.environ.get('DB_ENSURE_INDEXES', 'true').lower() == 'true'  # create missing indexes on startup
+
 DB_NAME = 'ZEST_DB'
 FAVORITES_COLLECTION = 'favorites'
-JWT_ALGORITHM = 'HS256'
\ No newline at end of file
+REPOSITORIES_COLLECTION = 'repositories'  # shared with the GitHub data service, which keeps it fresh
+FAVORITES_PAGE_SIZE = 100  # default page size of GET /favorites
+FAVORITES_MAX_PAGE_SIZE = 1000
+FAVORITES_STREAM_BATCH_SIZE = 200  # documents read from MongoDB per round trip when streaming
+FAVORITES_MAX_BULK_OPERATIONS = 500  # operations allowed in a single POST /favorites/bulk
+JWT_ALGORITHM = 'HS256'
+
+# GitHub data service - favorites are enriched with its live repository data, one call per page
+LIVE_REPOSITORY_DATA_ENABLED = os.environ.get('LIVE_REPOSITORY_DATA_ENABLED', 'true').lower() == 'true'
+GITHUB_DATA_SERVICE_URL = os.environ.get('GITHUB_DATA_SERVICE_URL', 'http://github_data_service:8080/github')
+GITHUB_DATA_SERVICE_TIMEOUT = 2  # seconds - favorites fall back to stored repository data past it
+GITHUB_DATA_SERVICE_POOL_SIZE = 10  # kept-alive connections to the GitHub data service
+GITHUB_DATA_SERVICE_MAX_IDS = 1000  # repositories looked up per call, its REPOSITORY_LOOKUP_MAX_IDS
+GITHUB_DATA_SERVICE_FAILURE_THRESHOLD = 5  # consecutive failures before calls stop for a while
+GITHUB_DATA_SERVICE_RESET_TIMEOUT = 30  # seconds before calling again once failures stopped the calls
+
+# Verified JWT cache - entries expire with their token
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', 10000))
+TOKEN_CACHE_TTL = 60 * 10  # seconds - only used for tokens without an exp claim
+
+# Redis - rate limit buckets, shared by every worker
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_SOCKET_TIMEOUT = 0.5  # seconds - past it the request is let through, rather than kept waiting on the limiter
+REDIS_SOCKET_CONNECT_TIMEOUT = 0.5  # seconds
+REDIS_HEALTH_CHECK_INTERVAL = 30  # seconds - idle connections are pinged before reuse
+
+# Admission control - requests past a rate limit get a 429, requests past the concurrency cap a 503
+RATE_LIMITS_ENABLED = os.environ.get('RATE_LIMITS_ENABLED', 'true').lower() == 'true'
+# Token buckets per route: `rate` requests per second sustained, `burst` at once,
+# per 'user' (JWT user ID) or per client 'ip'
+RATE_LIMITS = {
+    'favorites_read': {'rate': 20, 'burst': 100, 'key': 'user'},
+    'favorites_write': {'rate': 10, 'burst': 50, 'key': 'user'},
+    'favorites_bulk': {'rate': 1, 'burst': 10, 'key': 'user'},  # up to FAVORITES_MAX_BULK_OPERATIONS writes each
+}
+# Concurrency cap per worker, 0 disables it. Defaults to what a worker runs at once (see gunicorn_conf.py):
+# WEB_THREADS with gthread workers, a quarter of WEB_WORKER_CONNECTIONS with gevent ones
+ADMISSION_MAX_CONCURRENT_REQUESTS = int(os.environ.get('ADMISSION_MAX_CONCURRENT_REQUESTS', (
+    int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000)) // 4 if os.environ.get('WEB_WORKER_CLASS') == 'gevent'
+    else int(os.environ.get('WEB_THREADS', 8)))))
+
+# Request profiling - spans of every request are kept, in case it turns out slow.
+# Profiled requests (all, a sample, or those with a matching X-Profile header) also get a stack profile.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))  # fraction of requests profiled
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # X-Profile header value of trusted callers
+PROFILING_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILING_SLOW_REQUEST_MS = int(os.environ.get('PROFILING_SLOW_REQUEST_MS', 1000))  # 0 disables slow request dumps
+PROFILING_DUMP_DIR = './logs/profiles'
+PROFILING_MAX_DUMPS = 200  # oldest dumps are deleted past this
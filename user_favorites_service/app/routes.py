@@ -1,15 +1,17 @@
-import jwt
-import os
-from flask import Blueprint, request, jsonify, current_app as app
+from flask import Blueprint, Response, request, jsonify, g, stream_with_context, current_app as app
 
-from utils.favorites_db import get_user_favorite_repositories, add_user_favorite_repository, remove_user_favorite_repository
+from utils.favorites_db import get_user_favorite_repositories, iter_user_favorite_repositories, add_user_favorite_repository, \
+    remove_user_favorite_repository, apply_user_favorite_operations, decode_cursor, FAVORITE_FIELDS
+from utils.auth import require_auth, get_token_cache_stats
+from utils.admission_control import rate_limit
 from utils.app_logging import logger
 
-SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
 favorite_repos_routes = Blueprint('favorite_repos_routes', __name__)
 
 
 @favorite_repos_routes.route('/favorites', methods=['POST'])
+@require_auth
+@rate_limit('favorites_write')
 def add_favorite_repo():
     """
     Endpoint to add a repository to a user's favorites list.
@@ -17,24 +19,18 @@ def add_favorite_repo():
     Returns:
         A JSON response with a success or error message.
     """
-    token = request.headers.get('Authorization')
-
-    if not token:
-        return jsonify({'error': 'Missing authorization token'}), 401
-    try:
-        user_id = jwt.decode(token, SECRET_KEY, algorithms=[
-                             app.config["JWT_ALGORITHM"]])['user_id']
-    except jwt.InvalidTokenError as e:
-        logger.error(f'There was an error decoding the token: {e}')
-
-        return jsonify({'error': f'Invalid authorization token.'}), 401
-
+    user_id = g.user_id
     repo = request.json.get('repository')
 
-    if not repo:
+    if not repo or not isinstance(repo, dict):
         return jsonify({'error': 'Missing repository data'}), 400
 
-    result = add_user_favorite_repository(user_id, repo)
+    repo_id = _parse_repository_id(repo.get('id'))
+
+    if repo_id is None:
+        return jsonify({'error': 'Invalid repository ID, should be a positive integer'}), 400
+
+    result = add_user_favorite_repository(user_id, repo_id)
 
     if result is None:
         return jsonify({'error': 'Failed to add repository to favorites'}), 500
@@ -45,6 +41,8 @@ def add_favorite_repo():
 
 
 @favorite_repos_routes.route('/favorites', methods=['DELETE'])
+@require_auth
+@rate_limit('favorites_write')
 def remove_favorite_repo():
     """
     Removes a repository from a user's favorites list.
@@ -52,18 +50,7 @@ def remove_favorite_repo():
     Returns:
         A JSON response with a success or error message.
     """
-    token = request.headers.get('Authorization')
-
-    if not token:
-        return jsonify({'error': 'Missing authorization token'}), 401
-    try:
-        user_id = jwt.decode(token, SECRET_KEY, algorithms=[
-                             app.config["JWT_ALGORITHM"]])['user_id']
-    except jwt.InvalidTokenError as e:
-        logger.error(f'There was an error decoding the token: {e}')
-        
-        return jsonify({'error': f'Invalid authorization token.'}), 401
-
+    user_id = g.user_id
     repo_id = str(request.args.get('repository_id'))
 
     if not repo_id:
@@ -79,31 +66,192 @@ def remove_favorite_repo():
         return jsonify({'message': 'Repository removed from favorites'}), 200
 
 
+@favorite_repos_routes.route('/favorites/bulk', methods=['POST'])
+@require_auth
+@rate_limit('favorites_bulk')
+def bulk_update_favorite_repos():
+    """
+    Adds and removes several repositories to and from a user's favorites list at once.
+
+    The request body contains an `operations` list. Each operation is either
+    {"action": "add", "repository": {...}} or {"action": "remove", "repository_id": "..."}.
+    A repository may appear in only one operation.
+
+    Returns:
+        A JSON response containing the result of each operation, in order - 'added', 'already_present',
+        'removed', 'missing' or 'failed' - and a 200 status code if successful.
+        A JSON response containing an error message and a 400 status code if the body or the operations are invalid.
+        A JSON response containing an error message and a 500 status code if the operations could not be applied.
+    """
+    user_id = g.user_id
+    body = request.get_json(silent=True)
+    max_operations = app.config['FAVORITES_MAX_BULK_OPERATIONS']
+
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Invalid request body, should be a JSON object'}), 400
+
+    operations = body.get('operations')
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'Missing operations'}), 400
+
+    if len(operations) > max_operations:
+        return jsonify({'error': f'Too many operations, at most {max_operations} are allowed'}), 400
+
+    parsed_operations = []
+
+    for index, operation in enumerate(operations):
+        action = operation.get('action') if isinstance(operation, dict) else None
+
+        if action == 'add' and isinstance(operation.get('repository'), dict):
+            repository_id = _parse_repository_id(operation['repository'].get('id'))
+
+            # Without its ID, the repository would be stored under 'None'
+            if repository_id is None:
+                return jsonify({'error': f'Missing or invalid repository ID at index {index}'}), 400
+
+            parsed_operations.append(('add', repository_id))
+        elif action == 'remove':
+            repository_id = _parse_repository_id(operation.get('repository_id'))
+
+            # Normalized like added IDs, so "021" removes the favorite stored as "21"
+            if repository_id is None:
+                return jsonify({'error': f'Missing or invalid repository ID at index {index}'}), 400
+
+            parsed_operations.append(('remove', repository_id))
+        else:
+            return jsonify({'error': f'Invalid operation at index {index}'}), 400
+
+    repository_ids = [repository_id for _, repository_id in parsed_operations]
+
+    if len(set(repository_ids)) != len(repository_ids):
+        return jsonify({'error': 'A repository may appear in only one operation'}), 400
+
+    results = apply_user_favorite_operations(user_id, parsed_operations)
+
+    if results is None:
+        return jsonify({'error': 'Failed to update favorites'}), 500
+
+    return jsonify({'results': [{'repository_id': repository_id, 'result': result}
+                                for repository_id, result in zip(repository_ids, results)]}), 200
+
+
 @favorite_repos_routes.route('/favorites', methods=['GET'])
+@require_auth
+@rate_limit('favorites_read')
 def get_favorite_repos():
     """
-    Retrieves the favorite repositories of a user.
+    Retrieves the favorite repositories of a user, a page at a time, in the order they were added.
+
+    Query parameters:
+        limit: The page size. Defaults to FAVORITES_PAGE_SIZE, at most FAVORITES_MAX_PAGE_SIZE.
+        cursor: The next_cursor of the previous page.
+        fields: 'ids', 'summary' or 'full' (default) - which repository fields to return.
+        stream: 'true' to stream the favorites as they are read from the database. Without a limit,
+                every favorite after the cursor is streamed.
 
     Returns:
-        A JSON response containing the user's favorite repositories and a 200 status code if successful.
+        A JSON response containing a page of the user's favorite repositories, the cursor of the next page
+        (null on the last page) and a 200 status code if successful.
+        A JSON response containing an error message and a 400 status code if a query parameter is invalid.
         A JSON response containing an error message and a 401 status code if the authorization token is missing or invalid.
+        A JSON response containing an error message and a 429 status code, with Retry-After, if the user sent too many requests.
         A JSON response containing an error message and a 500 status code if the favorite repositories could not be retrieved.
     """
-    token = request.headers.get('Authorization')
+    user_id = g.user_id
+    stream = request.args.get('stream', 'false').lower() == 'true'
+    fields = request.args.get('fields', 'full')
+
+    if fields not in FAVORITE_FIELDS:
+        return jsonify({'error': f"Invalid fields, should be one of {', '.join(FAVORITE_FIELDS)}"}), 400
 
-    if not token:
-        return jsonify({'error': 'Missing authorization token'}), 401
     try:
-        user_id = jwt.decode(token, SECRET_KEY, algorithms=[
-                             app.config["JWT_ALGORITHM"]])['user_id']
-    except jwt.InvalidTokenError as e:
-        logger.error(f'There was an error decoding the token: {e}')
+        if 'limit' in request.args:
+            limit = _parse_limit(request.args['limit'])
+        else:
+            limit = None if stream else app.config['FAVORITES_PAGE_SIZE']
+        after = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        return jsonify({'error': f'Invalid authorization token.'}), 401
+    if stream:
+        return _stream_favorite_repos(user_id, after, limit, fields)
 
-    favorite_repos = get_user_favorite_repositories(user_id)
+    result = get_user_favorite_repositories(user_id, limit, after, fields)
 
-    if favorite_repos is None:
+    if result is None:
         return jsonify({'error': 'Failed to retrieve favorite repositories'}), 500
 
-    return jsonify({'favorite_repos': favorite_repos}), 200
+    favorite_repos, next_cursor = result
+
+    return jsonify({'favorite_repos': favorite_repos, 'next_cursor': next_cursor}), 200
+
+
+def _stream_favorite_repos(user_id, after, limit, fields):
+    """
+    Streams the favorite repositories of a user as a JSON response, without building the list in memory.
+
+    The body has the same shape as a page of favorites. If the database fails midway, the stream is cut,
+    so the client gets invalid JSON rather than a silently truncated list.
+    """
+    def generate():
+        yield '{"favorite_repos": ['
+        next_cursor = None
+        count = 0
+        # Ask for one more favorite than needed, to know whether there is a next page
+        favorites = iter_user_favorite_repositories(
+            user_id, after, limit + 1 if limit is not None else None, fields,
+            batch_size=app.config['FAVORITES_STREAM_BATCH_SIZE'])
+
+        try:
+            for favorite, cursor in favorites:
+                if count == limit:
+                    break
+
+                yield (',' if count else '') + app.json.dumps(favorite)
+                next_cursor = cursor
+                count += 1
+            else:
+                next_cursor = None
+        except Exception as e:
+            logger.error(f"Failed to stream user's favorite repositories. Error: {e}")
+
+            return
+
+        logger.info(f"Streamed user {user_id}'s favorite repositories. Count: {count}")
+        yield '], "next_cursor": ' + app.json.dumps(next_cursor) + '}'
+
+    return Response(stream_with_context(generate()), status=200, mimetype='application/json')
+
+
+def _parse_repository_id(value):
+    """
+    Returns a repository's GitHub ID as the string favorites are stored under, or None if it isn't a positive integer.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value) if value > 0 else None
+
+    if isinstance(value, str) and value.isascii() and value.isdigit() and int(value) > 0:
+        return str(int(value))
+
+    return None
+
+
+def _parse_limit(value):
+    max_limit = app.config['FAVORITES_MAX_PAGE_SIZE']
+
+    if not value.isdigit() or not 0 < int(value) <= max_limit:
+        raise ValueError(f"Invalid limit, should be between 1 and {max_limit}")
+
+    return int(value)
+
+
+@favorite_repos_routes.route('/token-cache-stats', methods=['GET'])
+def token_cache_stats():
+    """
+    Returns the verified token cache counters of this worker.
+
+    Returns:
+        A JSON response containing the cache hits, misses, size and the total time spent verifying tokens.
+    """
+    return jsonify(get_token_cache_stats()), 200
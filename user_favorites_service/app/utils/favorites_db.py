@@ -1,100 +1,304 @@
+import base64
+import binascii
+import json
 from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, IndexModel, UpdateOne, DeleteOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from flask import current_app as app
 
-from utils.db_manager import get_collection, get_database, close_client, create_mongo_client
+from utils.db_manager import get_collection, get_database, get_mongo_client, get_client_options, ensure_indexes
+from utils.github_data_client import get_live_repositories
 from utils.app_logging import logger
 
+DUPLICATE_KEY_ERROR = 11000
+
+# MongoDB projections of the favorite repository fields clients can ask for.
+# Favorites only reference repositories, whose data is read from the shared repositories collection,
+# which only the GitHub data service writes. Favorites added before that still embed their repository_data,
+# which is used as a fallback for them (see Architecture in the README).
+SUMMARY_FIELDS = ['name', 'description', 'html_url', 'language', 'stars']
+FAVORITE_FIELDS = {
+    'ids': {'repository_id': 1, 'added_at': 1},
+    'summary': dict({'repository_id': 1, 'added_at': 1}, **{f'repository_data.{field}': 1 for field in SUMMARY_FIELDS}),
+    'full': None
+}
+REPOSITORY_FIELDS = {
+    'summary': {field: 1 for field in SUMMARY_FIELDS},
+    'full': {'synced_at': 0}
+}
+
+
+def _get_favorites_collection():
+    """
+    Get the favorites collection using the process-wide pooled MongoClient.
+
+    Returns:
+        pymongo.collection.Collection: The favorites collection.
+    """
+    client = get_mongo_client(app.config['DB_URI'], **get_client_options(app.config))
+    db = get_database(client, app.config['DB_NAME'])
+
+    return get_collection(db, app.config['FAVORITES_COLLECTION'])
+
+
+def _get_repositories_collection():
+    """
+    Get the shared repositories collection using the process-wide pooled MongoClient.
+
+    Returns:
+        pymongo.collection.Collection: The repositories collection.
+    """
+    client = get_mongo_client(app.config['DB_URI'], **get_client_options(app.config))
+    db = get_database(client, app.config['DB_NAME'])
+
+    return get_collection(db, app.config['REPOSITORIES_COLLECTION'])
+
+
+def ensure_favorites_indexes():
+    """
+    Create the indexes of the favorites collection, if missing.
 
-def get_user_favorite_repositories(user_id):
+    Returns:
+        bool: True if every index exists, False otherwise.
+    """
+    indexes = [
+        # A repository can be in a user's favorites only once
+        IndexModel([('user_id', ASCENDING), ('repository_id', ASCENDING)],
+                   name='user_repository_unique', unique=True),
+        # Pages through a user's favorites in the order they were added
+        IndexModel([('user_id', ASCENDING), ('added_at', ASCENDING), ('_id', ASCENDING)],
+                   name='user_added_at_id')
+    ]
+
+    return ensure_indexes(_get_favorites_collection(), indexes)
+
+
+def get_user_favorite_repositories(user_id, limit, after=None, fields='full'):
     """
-    Retrieve a list of favorite repositories for a given user.
+    Retrieve a page of favorite repositories for a given user, in the order they were added.
 
     Args:
         user_id (str): The ID of the user whose favorite repositories to retrieve.
+        limit (int): The maximum number of favorite repositories to retrieve.
+        after (tuple, optional): A decoded cursor (see decode_cursor). Only favorites added after it are retrieved.
+        fields (str, optional): Which repository fields to retrieve, one of FAVORITE_FIELDS. Defaults to 'full'.
 
     Returns:
-        list: A list of dictionaries, where each dictionary contains the repository's ID, data, and the date it was added.
-              Returns None if an error occurs while retrieving the data.
+        tuple: A list of dictionaries, where each dictionary contains the repository's ID, data, and the date it was added,
+               and the cursor of the next page (None if this is the last page).
+               Returns None if an error occurs while retrieving the data.
     """
-    
-    db_uri = app.config['DB_URI']
-    db_name = app.config['DB_NAME']
-    favorites_collection_name = app.config['FAVORITES_COLLECTION']
 
     try:
-        client = create_mongo_client(db_uri)
-        db = get_database(client, db_name)
-        collection = get_collection(db, favorites_collection_name)
-
-        # Find all repositories that belong to the user.
-        # Then, for each repository, return a dictionary containing the repository's data and the date it was added.
-        cursor = collection.find({'user_id': user_id})
-        favorite_repositories = [{'repository_id': repository['repository_id'], 'repository:': repository['repository_data'], 'added_at': repository['added_at']}
-                                 for repository in cursor]
+        favorite_repositories = []
+        next_cursor = None
+
+        # Ask for one more favorite than needed, to know whether there is a next page.
+        # The whole page is a single batch, so its repositories are looked up in a single call.
+        favorites = iter_user_favorite_repositories(user_id, after, limit + 1, fields, batch_size=limit + 1)
+
+        for favorite, cursor in favorites:
+            if len(favorite_repositories) == limit:
+                break
+
+            favorite_repositories.append(favorite)
+            next_cursor = cursor
+        else:
+            next_cursor = None
+
         logger.info(
             f"Retrieved user {user_id}'s favorite repositories. Count: {len(favorite_repositories)}")
 
-        return favorite_repositories
+        return favorite_repositories, next_cursor
     except Exception as e:
         logger.error(
             f"Failed to retrieve user's favorite repositories. Error: {e}")
 
         return None
-    finally:
-        close_client(client)
 
 
-def add_user_favorite_repository(user_id, repository):
+def iter_user_favorite_repositories(user_id, after=None, limit=None, fields='full', batch_size=None):
+    """
+    Iterate over the favorite repositories of a given user, in the order they were added.
+
+    Documents are read from the Mongo cursor in batches, so the favorites are never all held in memory.
+    The repository data of each batch is then looked up at once (see _get_repositories).
+
+    Args:
+        user_id (str): The ID of the user whose favorite repositories to retrieve.
+        after (tuple, optional): A decoded cursor (see decode_cursor). Only favorites added after it are retrieved.
+        limit (int, optional): The maximum number of favorite repositories to retrieve. Defaults to all of them.
+        fields (str, optional): Which repository fields to retrieve, one of FAVORITE_FIELDS. Defaults to 'full'.
+        batch_size (int, optional): The number of documents to read from MongoDB per round trip.
+            Defaults to FAVORITES_STREAM_BATCH_SIZE.
+
+    Yields:
+        tuple: A favorite repository dictionary, and the cursor that points right after it.
+    """
+    collection = _get_favorites_collection()
+    query = {'user_id': user_id}
+
+    if after is not None:
+        added_at, favorite_id = after
+        query['$or'] = [{'added_at': {'$gt': added_at}},
+                        {'added_at': added_at, '_id': {'$gt': favorite_id}}]
+
+    cursor = collection.find(query, FAVORITE_FIELDS[fields]).sort(
+        [('added_at', ASCENDING), ('_id', ASCENDING)])
+
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    batch_size = batch_size or app.config['FAVORITES_STREAM_BATCH_SIZE']
+    cursor = cursor.batch_size(batch_size)
+
+    for batch in _iter_batches(cursor, batch_size):
+        repositories = {}
+
+        if fields != 'ids':
+            repositories = _get_repositories(
+                [favorite['repository_id'] for favorite in batch], fields)
+
+        for favorite in batch:
+            repository_id = favorite['repository_id']
+            item = {'repository_id': repository_id, 'added_at': favorite['added_at']}
+
+            if fields != 'ids':
+                item['repository:'] = repositories.get(
+                    _get_repository_key(repository_id), favorite.get('repository_data'))
+
+            yield item, _encode_cursor(favorite)
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor returned along with a page of favorite repositories.
+
+    Args:
+        cursor (str): The cursor.
+
+    Returns:
+        tuple: The date the favorite the cursor points at was added, and its ID.
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+        return datetime.fromisoformat(position['added_at']), ObjectId(position['id'])
+    except (TypeError, KeyError, binascii.Error, InvalidId, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _get_repositories(repository_ids, fields):
+    """
+    Read the data of several repositories, with a single call to the GitHub data service for their live data
+    (one per GITHUB_DATA_SERVICE_MAX_IDS repositories).
+
+    Repositories the GitHub data service doesn't return, or all of them when it is unavailable,
+    are read from the repositories collection instead, in a single query.
+
+    Returns:
+        dict: The repositories that were found, by their key (see _get_repository_key).
+    """
+    repositories = {}
+
+    if app.config['LIVE_REPOSITORY_DATA_ENABLED']:
+        live_repositories = {}
+
+        for ids in _iter_batches([repository_id for repository_id in repository_ids if repository_id.isdigit()],
+                                 app.config['GITHUB_DATA_SERVICE_MAX_IDS']):
+            live_repositories.update(get_live_repositories(ids) or {})
+
+        for repository_id, repository in live_repositories.items():
+            repository.pop('id', None)
+
+            if fields == 'summary':
+                repository = {field: repository.get(field) for field in SUMMARY_FIELDS}
+
+            repositories[_get_repository_key(repository_id)] = repository
+
+    keys = [key for key in map(_get_repository_key, repository_ids) if key not in repositories]
+
+    if keys:
+        collection = _get_repositories_collection()
+        repositories.update((repository.pop('_id'), repository)
+                            for repository in collection.find({'_id': {'$in': keys}}, REPOSITORY_FIELDS[fields]))
+
+    return repositories
+
+
+def _get_repository_key(repository_id):
+    """
+    Returns the _id of a repository in the repositories collection - its numeric GitHub ID when possible.
+    """
+    return int(repository_id) if repository_id.isdigit() else repository_id
+
+
+def _iter_batches(iterable, size):
+    batch = []
+
+    for item in iterable:
+        batch.append(item)
+
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _encode_cursor(repository):
+    position = {'added_at': repository['added_at'].isoformat(), 'id': str(repository['_id'])}
+
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def add_user_favorite_repository(user_id, repository_id):
     """
     Adds a favorite repository to the user's favorites in the database.
 
     Args:
         user_id (str): The ID of the user.
-        repository (dict): A dictionary containing the repository data.
+        repository_id (str): The repository's validated numeric GitHub ID.
 
     Returns:
         bool: True if the repository was added successfully, False if the repository already exists in the user's favorites, None if an error occurred.
     """
 
-    db_uri = app.config['DB_URI']
-    db_name = app.config['DB_NAME']
-    favorites_collection_name = app.config['FAVORITES_COLLECTION']
-
     try:
-        client = create_mongo_client(db_uri)
-        db = get_database(client, db_name)
-        collection = get_collection(db, favorites_collection_name)
-
-        repository_id = str(repository.pop('id', None))
+        collection = _get_favorites_collection()
 
-        # Check if the repository already exists in the user's favorites.
-        existing_favorite = collection.find_one(
-            {'user_id': user_id, 'repository_id': repository_id})
+        # Add the repository to the user's favorites, unless it is already there, in a single round trip.
+        # The unique (user_id, repository_id) index keeps concurrent adds from creating duplicates.
+        result = collection.update_one(
+            *_get_add_favorite_update(user_id, repository_id), upsert=True)
 
-        if existing_favorite is not None:
+        if result.upserted_id is None:
             logger.warning(
                 f"Repository {repository_id} already exists in user's favorites.")
             return False
 
-        # Add new favorite repository to the user's favorites in the database.
-        data = {
-            'user_id': user_id,
-            'added_at': datetime.utcnow(),
-            'repository_id': repository_id,
-            'repository_data': repository
-        }
-        result = collection.insert_one(data)
         logger.info(
-            f"Added repository to user's favorites. Result: {result}")
+            f"Added repository to user's favorites. ID: {result.upserted_id}")
+        _store_missing_repositories([repository_id])
 
         return True
+    except DuplicateKeyError:
+        # A concurrent request added the same repository between our match and insert
+        logger.warning(
+            f"Repository {repository_id} already exists in user's favorites.")
+
+        return False
     except Exception as e:
         logger.error(
             f"Failed to add repository to user's favorites. Error: {e}")
 
         return None
-    finally:
-        close_client(client)
 
 
 def remove_user_favorite_repository(user_id, repository_id):
@@ -109,14 +313,8 @@ def remove_user_favorite_repository(user_id, repository_id):
         bool: True if the repository was successfully removed, False if the repository was not found in the user's favorites, or None if an error occurred.
     """
 
-    db_uri = app.config['DB_URI']
-    db_name = app.config['DB_NAME']
-    favorites_collection_name = app.config['FAVORITES_COLLECTION']
-
     try:
-        client = create_mongo_client(db_uri)
-        db = get_database(client, db_name)
-        collection = get_collection(db, favorites_collection_name)
+        collection = _get_favorites_collection()
 
         # Remove the repository from the user's favorites in the database.
         result = collection.delete_one(
@@ -137,5 +335,115 @@ def remove_user_favorite_repository(user_id, repository_id):
             f"Failed to remove repository from user's favorites. Error: {e}")
 
         return None
-    finally:
-        close_client(client)
+
+
+def apply_user_favorite_operations(user_id, operations):
+    """
+    Add and remove several repositories to and from a user's favorites, in a single unordered bulk write.
+
+    Deletes don't report which of them matched, so when there are removals, the favorites to remove are
+    looked up first, in a second round trip. The two steps aren't atomic: if a concurrent request adds or
+    removes one of these favorites in between, its 'removed' or 'missing' result can be wrong.
+    The favorites themselves are still updated correctly.
+
+    Args:
+        user_id (str): The ID of the user.
+        operations (list): Tuples of (action, repository_id), where action is 'add' or 'remove'.
+            A repository must not appear in more than one operation.
+
+    Returns:
+        list: The result of each operation, in the same order - 'added', 'already_present', 'removed',
+              'missing' or 'failed'. Returns None if an error occurred before anything was written.
+    """
+
+    try:
+        collection = _get_favorites_collection()
+
+        # Deletes don't report which of them matched, so look up the favorites to remove first
+        remove_ids = [repository_id for action, repository_id in operations if action == 'remove']
+        existing_ids = set()
+
+        if remove_ids:
+            existing = collection.find(
+                {'user_id': user_id, 'repository_id': {'$in': remove_ids}}, {'repository_id': 1})
+            existing_ids = {favorite['repository_id'] for favorite in existing}
+
+        requests = []
+
+        for action, repository_id in operations:
+            if action == 'add':
+                requests.append(UpdateOne(
+                    *_get_add_favorite_update(user_id, repository_id), upsert=True))
+            else:
+                requests.append(DeleteOne({'user_id': user_id, 'repository_id': repository_id}))
+
+        try:
+            upserted_indexes = set(collection.bulk_write(requests, ordered=False).upserted_ids)
+            failed_indexes = {}
+        except BulkWriteError as e:
+            # Some operations failed, the others were still applied
+            upserted_indexes = {upsert['index'] for upsert in e.details.get('upserted', [])}
+            failed_indexes = {error['index']: error['code'] for error in e.details.get('writeErrors', [])}
+            logger.warning(f"Bulk write of user {user_id}'s favorites partially failed. Errors: {failed_indexes}")
+
+        _store_missing_repositories([repository_id for index, (_, repository_id) in enumerate(operations)
+                                     if index in upserted_indexes])
+        results = []
+
+        for index, (action, repository_id) in enumerate(operations):
+            if index in failed_indexes:
+                # A duplicate key means a concurrent request added the repository first
+                results.append('already_present' if failed_indexes[index] == DUPLICATE_KEY_ERROR else 'failed')
+            elif action == 'add':
+                results.append('added' if index in upserted_indexes else 'already_present')
+            else:
+                results.append('removed' if repository_id in existing_ids else 'missing')
+
+        logger.info(
+            f"Applied {len(operations)} operations to user {user_id}'s favorites.")
+
+        return results
+    except Exception as e:
+        logger.error(
+            f"Failed to apply operations to user's favorites. Error: {e}")
+
+        return None
+
+
+def _get_add_favorite_update(user_id, repository_id):
+    """
+    Returns the filter and update that add a repository to a user's favorites, if it isn't there yet.
+    The favorite only references the repository, its data is kept in the repositories collection.
+    """
+    return (
+        {'user_id': user_id, 'repository_id': repository_id},
+        {'$setOnInsert': {
+            'added_at': datetime.utcnow()
+        }}
+    )
+
+
+def _store_missing_repositories(repository_ids):
+    """
+    Makes sure newly added favorite repositories are in the shared repositories collection.
+
+    The ones it doesn't have yet are looked up through the GitHub data service, which fetches them from
+    GitHub API and stores them. Failures are logged and ignored, the favorites are added anyway.
+
+    Args:
+        repository_ids (list): GitHub repository IDs.
+    """
+    if not repository_ids:
+        return
+
+    try:
+        keys = [_get_repository_key(repository_id) for repository_id in repository_ids]
+        stored = {repository['_id'] for repository
+                  in _get_repositories_collection().find({'_id': {'$in': keys}}, {'_id': 1})}
+        missing_ids = [str(key) for key in keys if key not in stored]
+
+        for ids in _iter_batches(missing_ids, app.config['GITHUB_DATA_SERVICE_MAX_IDS']):
+            if get_live_repositories(ids) is None:
+                logger.warning(f"Failed to store repositories {ids} through the GitHub data service")
+    except Exception as e:
+        logger.error(f"Failed to store the repositories of new favorites. Error: {e}")
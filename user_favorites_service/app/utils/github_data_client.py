@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from flask import current_app as app
+
+from utils.app_logging import logger, get_request_id, REQUEST_ID_HEADER
+from utils.metrics import observe, count_error, POOL_CONNECTIONS
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_breaker = None
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while, instead of making every request wait for its timeout.
+
+    After failure_threshold consecutive failures the circuit opens, and calls are refused for reset_timeout seconds.
+    Then a single trial call is let through: the circuit closes if it succeeds, and opens again if it fails.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns:
+            bool: True if the dependency may be called, False while the circuit is open.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+
+            self._trial_running = True
+
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        f"Circuit opened after {self._failures} failures, retrying in {self.reset_timeout}s")
+
+                self._opened_at = time.monotonic()
+
+
+class _MeteredPoolMixin:
+    """
+    Reports the open and checked out connections of a urllib3 connection pool (see POOL_CONNECTIONS).
+    Open connections are the checked out ones, plus the idle ones kept in the pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checked_out = 0
+        self._checked_out_lock = threading.Lock()
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        self._count_checked_out(1)
+
+        return connection
+
+    def _put_conn(self, conn):
+        super()._put_conn(conn)
+        self._count_checked_out(-1)
+
+    def _count_checked_out(self, delta):
+        with self._checked_out_lock:
+            self._checked_out += delta
+            # The pool is None once closed
+            idle = sum(1 for connection in list(self.pool.queue) if connection is not None) if self.pool else 0
+            POOL_CONNECTIONS.labels('github_data_service', 'open').set(self._checked_out + idle)
+            POOL_CONNECTIONS.labels('github_data_service', 'checked_out').set(self._checked_out)
+
+
+class _MeteredHTTPConnectionPool(_MeteredPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _MeteredHTTPSConnectionPool(_MeteredPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _MeteredHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter whose connection pools report their connections.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _MeteredHTTPConnectionPool,
+            'https': _MeteredHTTPSConnectionPool
+        }
+
+
+def get_live_repositories(repository_ids):
+    """
+    Retrieve the live data of several repositories from the GitHub data service, in a single call.
+
+    Args:
+        repository_ids (list): GitHub repository IDs.
+
+    Returns:
+        dict: The repositories that were found, by their ID (str).
+              Returns None if the GitHub data service could not be called - the caller falls back to stored data.
+    """
+    breaker = _get_breaker()
+
+    if not repository_ids:
+        return None
+
+    if not breaker.allow():
+        count_error('github_data_service', 'circuit_open')
+
+        return None
+
+    try:
+        with observe('github_data_service', 'repositories'):
+            response = _get_session().get(
+                f"{app.config['GITHUB_DATA_SERVICE_URL']}/repositories",
+                params={'ids': ','.join(repository_ids)},
+                headers={REQUEST_ID_HEADER: get_request_id() or ''},
+                timeout=app.config['GITHUB_DATA_SERVICE_TIMEOUT'])
+            response.raise_for_status()
+        repositories = response.json()['repositories']
+
+        if not isinstance(repositories, dict):
+            raise ValueError(f"Unexpected repositories of type {type(repositories).__name__}")
+
+        breaker.record_success()
+
+        return repositories
+    except Exception as e:
+        # Anything unexpected must still count as a failure, or a trial call would keep the circuit open for good
+        breaker.record_failure()
+        logger.error(f"Failed to retrieve live repositories from the GitHub data service. Error: {e}")
+
+        return None
+
+
+def _get_session():
+    """
+    Returns the process-wide session, whose connections to the GitHub data service are kept alive and reused.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            pool_size = app.config['GITHUB_DATA_SERVICE_POOL_SIZE']
+            _session = requests.Session()
+            _session.mount('http://', _MeteredHTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _session.mount('https://', _MeteredHTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _session_pid = os.getpid()
+
+        return _session
+
+
+def _get_breaker():
+    global _breaker
+
+    with _session_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(app.config['GITHUB_DATA_SERVICE_FAILURE_THRESHOLD'],
+                                      app.config['GITHUB_DATA_SERVICE_RESET_TIMEOUT'])
+
+        return _breaker